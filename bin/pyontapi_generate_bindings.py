@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    pyontapi_generate_bindings
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Command-Line tool for writing static binding modules, see
+    :mod:`schtob.pyontapi.bindings`.
+
+    :copyright: 2010-2015 Schaefer & Tobies SuC GmbH.
+    :author: Markus Grimm <mgr@schaefer-tobies.de>;
+             Uwe W. Schaefer <uws@schaefer-tobies.de>
+    :license: LGPL, see LICENSE for details.
+"""
+
+import json
+import logging
+import os
+import sys
+logging.basicConfig()
+
+
+def main(args):
+    """Write the binding module for a schema cache entry or a filer into
+    directory `OUTPUT_DIR`.
+
+    :param args Commandline arguments minus program name
+
+    Examples:
+    ./pyontapi_generate_bindings.py OUTPUT_DIR SCHEMA_CACHE_ENTRY [SERVER_TYPE]
+    PW=secret ./pyontapi_generate_bindings.py OUTPUT_DIR \\
+        --filer FILER-HOSTNAME USER port=80
+    """
+    if len(args) < 2 or (args[1] == '--filer' and len(args) < 4):
+        print(main.__doc__)
+        sys.exit(2)
+
+    directory = args[0]
+    if args[1] == '--filer':
+        types, elements, server_type, ontapi_version = \
+            get_filer_schema(args[2], args[3], args[4:])
+    else:
+        handle = open(args[1])
+        try:
+            entry = json.load(handle)
+        finally:
+            handle.close()
+        types = entry['types']
+        elements = entry['elements']
+        ontapi_version = entry['ontapi_version']
+        server_type = 'Filer'
+        if len(args) > 2:
+            server_type = args[2]
+
+    path = bindings.write_module(directory, types, elements, server_type,
+                                 ontapi_version)
+    print('wrote %s' % path)
+
+
+def get_filer_schema(filer_name, user, args):
+    """Get the API types and elements, the server type and the ONTAPI
+    version of filer `filer_name`.
+    """
+    cfg = {'user': user, 'lazy_api': True}
+    cfg.update([i.split('=', 1) for i in args])
+    if 'port' in cfg:
+        cfg['port'] = int(cfg['port'])
+    if os.environ.get('PW') is not None:
+        cfg['password'] = os.environ['PW']
+
+    try:
+        filer = NaFiler(filer_name, cfg)
+        package = system.System(filer)
+        types = py_gen.get_api_types(package)
+        elements = py_gen.get_api_elements(package, cfg.get('cmd_list'),
+                                           settings=filer.settings)
+    except errors.APIFailure:
+        print(sys.exc_info()[1])
+        sys.exit(1)
+    return (types, elements, filer.settings['server_type'],
+            filer.settings['ontapi_version'])
+
+
+def setup_path():
+    """Try to add the pyontapi base dir to `sys.path`."""
+    basedir = os.path.join(os.path.dirname(__file__), os.pardir, 'src')
+    try:
+        __import__('schtob.pyontapi')
+    except ImportError:
+        sys.path.append(basedir)
+
+
+if __name__ == '__main__':
+    setup_path()
+    from schtob.pyontapi import NaFiler, bindings, errors, py_gen, system
+
+    main(sys.argv[1:])
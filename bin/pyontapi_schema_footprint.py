@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    pyontapi_schema_footprint
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Command-Line tool for measuring the memory used by the API schema of a
+    filer, using an entry of the schema cache (see setting
+    `schema_cache_dir`). Requires Python >= 3.4.
+
+    :copyright: 2010-2015 Schaefer & Tobies SuC GmbH.
+    :author: Markus Grimm <mgr@schaefer-tobies.de>;
+             Uwe W. Schaefer <uws@schaefer-tobies.de>
+    :license: LGPL, see LICENSE for details.
+"""
+
+import gc
+import json
+import os
+import sys
+
+# Default upper limits of the memory per package and per command an
+# additional filer sharing the catalog may need.
+FILER_BYTES_PER_PACKAGE = 1024
+FILER_BYTES_PER_COMMAND = 192
+
+
+def main(args):
+    """Print the memory used by the API catalog built out of a schema cache
+    entry, by compiling the invocation plans of all its commands, by the
+    API classes and by the API instances and bound commands of one
+    additional filer sharing the catalog.
+
+    Exits with status 1 if the catalog and the plans need more than
+    `MAX_BYTES` or the additional filer needs more than `MAX_FILER_BYTES`
+    (default :data:`FILER_BYTES_PER_PACKAGE` per package and
+    :data:`FILER_BYTES_PER_COMMAND` per command).
+
+    Example:
+    ./pyontapi_schema_footprint.py /var/cache/pyontapi/schema-XXX.json 50000000
+    """
+    if len(args) not in (1, 2, 3):
+        print('usage: %s SCHEMA_CACHE_ENTRY [MAX_BYTES [MAX_FILER_BYTES]]' %
+              os.path.basename(sys.argv[0]))
+        sys.exit(2)
+    try:
+        import tracemalloc
+    except ImportError:
+        print('tracemalloc is not available, Python >= 3.4 is required')
+        sys.exit(2)
+
+    handle = open(args[0])
+    try:
+        entry = json.load(handle)
+    finally:
+        handle.close()
+
+    tracemalloc.start()
+    # the raw results are part of the catalog as well
+    start = measure(tracemalloc)
+    catalog = py_gen.APICatalog(entry['types'], entry['elements'])
+    catalog_size = measure(tracemalloc) - start
+
+    start = measure(tracemalloc)
+    commands = 0
+    for package_commands in catalog.packages.values():
+        for command in package_commands:
+            command.get_plan()
+            commands += 1
+    plans_size = measure(tracemalloc) - start
+
+    start = measure(tracemalloc)
+    first_apis = [catalog.get_api_class(api.BaseAPI, package)(None)
+                  for package in catalog.packages]
+    classes_size = measure(tracemalloc) - start
+
+    # an additional filer holds nothing of the schema but its API instances
+    # and the commands bound to them
+    start = measure(tracemalloc)
+    filer_apis = []
+    for package, package_commands in catalog.packages.items():
+        instance = catalog.get_api_class(api.BaseAPI, package)(None)
+        filer_apis.append(instance)
+        filer_apis.extend([getattr(instance, command.get_py_name())
+                           for command in package_commands])
+    filer_size = measure(tracemalloc) - start
+    max_filer_size = len(catalog.packages) * FILER_BYTES_PER_PACKAGE + \
+        commands * FILER_BYTES_PER_COMMAND
+    if len(args) == 3:
+        max_filer_size = int(args[2])
+
+    print('commands:                %d' % commands)
+    print('catalog:                 %d bytes' % catalog_size)
+    print('invocation plans:        %d bytes' % plans_size)
+    print('API classes:             %d bytes (%d packages)' %
+          (classes_size, len(first_apis)))
+    print('per additional filer:    %d bytes' % filer_size)
+
+    status = 0
+    if len(args) >= 2 and catalog_size + plans_size > int(args[1]):
+        print('catalog and plans exceed %s bytes' % args[1])
+        status = 1
+    if filer_size > max_filer_size:
+        print('additional filer exceeds %d bytes' % max_filer_size)
+        status = 1
+    sys.exit(status)
+
+
+def measure(tracemalloc):
+    """Return the currently traced memory after a garbage collection."""
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def setup_path():
+    """Try to add the pyontapi base dir to `sys.path`."""
+    basedir = os.path.join(os.path.dirname(__file__), os.pardir, 'src')
+    try:
+        __import__('schtob.pyontapi')
+    except ImportError:
+        sys.path.append(basedir)
+
+
+if __name__ == '__main__':
+    setup_path()
+    from schtob.pyontapi import api, py_gen
+
+    main(sys.argv[1:])
@@ -56,7 +56,9 @@ def main():
         platforms=['POSIX', 'Windows'],
         packages=['schtob', 'schtob.pyontapi'],
         package_dir = {'': 'src'},
-        scripts=[os.path.join('bin', 'pyontapi_list_commands.py')],
+        scripts=[os.path.join('bin', 'pyontapi_list_commands.py'),
+                 os.path.join('bin', 'pyontapi_schema_footprint.py'),
+                 os.path.join('bin', 'pyontapi_generate_bindings.py')],
         classifiers=[
             'Programming Language :: Python :: 2',
             'Programming Language :: Python :: 2.4',
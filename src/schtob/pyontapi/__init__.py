@@ -13,7 +13,13 @@
 
 VERSION = '0.3.2'
 
+import sys
+
 from schtob.pyontapi.na_connection import Filers
 from schtob.pyontapi.na_filer import NaFiler
 
 __all__ = ('NaFiler', 'Filers')
+
+if sys.version_info >= (3, 5):
+    from schtob.pyontapi.na_async import AsyncNaFiler
+    __all__ += ('AsyncNaFiler',)
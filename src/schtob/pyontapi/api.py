@@ -11,9 +11,16 @@
     :license: LGPL, see LICENSE for details.
 """
 
+import collections
 import logging
+import sys
+import threading
+import time
+import types
+import xml.parsers.expat
 
-from schtob.pyontapi.errors import PyontapiError, UnknownCommandError
+from schtob.pyontapi.errors import APIFailure, PyontapiError
+from schtob.pyontapi.errors import UnknownCommandError
 
 GENERIC_TYPEDEFS = {
     'boolean': bool,
@@ -23,6 +30,11 @@ GENERIC_TYPEDEFS = {
 
 GENERIC_TYPES = tuple(GENERIC_TYPEDEFS.values())
 
+try:
+    _intern = sys.intern
+except AttributeError:
+    _intern = intern
+
 
 class APICommand(object):
     """Representation of API Command for generating API package."""
@@ -30,6 +42,7 @@ class APICommand(object):
     def __init__(self, name, elements):
         self.name = name
         self.elements = elements
+        self._plan = None
 
     def get_package(self):
         """Get package of this API command."""
@@ -88,23 +101,112 @@ class APICommand(object):
         for field in self.get_output_fields():
             yield '`%s` : %s' % (field.name, field.get_type_name())
 
+    def get_plan(self):
+        """Get the :class:`InvocationPlan` of this API command. The plan is
+        compiled on first use.
+        """
+        if self._plan is None:
+            self._plan = InvocationPlan.for_command(self)
+        return self._plan
+
+    def get_serializer(self):
+        """Get the :class:`RequestSerializer` for the arguments."""
+        return self.get_plan().serializer
+
+    def get_decoder(self):
+        """Get the :class:`ResponseDecoder` for the output fields."""
+        return self.get_plan().decoder
+
+
+class InvocationPlan(object):
+    """Everything needed to invoke an :class:`APICommand`, compiled once.
+
+    Holds the Python argument names with their defaults, the set of valid
+    keyword arguments, the request serializer for the `arguments`
+    (:class:`NaArgument` instances) and the response decoder for the
+    `fields` (:class:`NaField` instances) of API command `name`.
+    """
+
+    def __init__(self, name, py_name, argument_names, defaults, arguments,
+                 fields):
+        self.name = name
+        self.py_name = py_name
+        self.argument_names = tuple(argument_names)
+        self.defaults = tuple(defaults)
+        self.valid_names = frozenset(self.argument_names)
+        self.serializer = RequestSerializer(name, arguments)
+        self.decoder = ResponseDecoder(fields)
+
+    def for_command(cls, command):
+        """Compile the plan of :class:`APICommand` `command`."""
+        arguments = list(command.get_arguments())
+        return cls(command.name, command.get_py_name(),
+                   [arg.name_to_py() for arg in arguments],
+                   [arg.get_default() for arg in arguments],
+                   [arg.get_py_cls() for arg in arguments],
+                   [field.get_py_cls()
+                    for field in command.get_output_fields()])
+
+    for_command = classmethod(for_command)
+
+    def get_request(self, kwargs):
+        """Return the serialized request element for keyword arguments
+        `kwargs`.
+        """
+        for key in kwargs:
+            if key not in self.valid_names:
+                raise TypeError("%s() got an unexpected keyword "
+                                "argument '%s'" % (self.py_name, key))
+        return self.serializer.serialize(
+            [kwargs.get(name, default)
+             for name, default in zip(self.argument_names, self.defaults)])
+
+
+def pop_deadline(kwargs, argument_names=()):
+    """Remove the `deadline` keyword out of `kwargs` and return it, unless
+    `deadline` is one of the `argument_names` of the API command.
+    """
+    if 'deadline' in argument_names:
+        return None
+    return kwargs.pop('deadline', None)
+
+
+def get_expires(deadline):
+    """Get the point in time when a call with a `deadline` in seconds
+    expires, or `None` without a deadline.
+    """
+    if deadline is None:
+        return None
+    return time.time() + deadline
+
+
+def get_remaining(expires):
+    """Get the seconds left until `expires`, see :func:`get_expires`."""
+    if expires is None:
+        return None
+    return expires - time.time()
+
 
 class TypeDef(object):
     """API Type class."""
 
+    # the attributes describing the type
     fields = (
-        'name', 'type_name', 'encrypted', 'nonempty', 'is_optional',
-        'is_output', 'is_validated', 'is_array',
+        'name', 'var_type', 'encrypted', 'nonempty', 'is_optional',
+        'is_output', 'is_array',
     )
 
+    __slots__ = fields + ('_py_type_cls',)
+
     def __init__(self, info, var_type):
         self.var_type = var_type
-        self.name = info.get('name')
+        self.name = intern_name(info.get('name'))
         self.encrypted = info.get('encrypted', False) or False
         self.nonempty = info.get('is-nonempty', False) or False
         self.is_optional = info.get('is-optional', False) or False
         self.is_output = info.get('is-output', False) or False
         self.is_array = ('[]' in info.get('type'))
+        self._py_type_cls = None
 
     def is_generic(self):
         """Check if type is generic."""
@@ -140,16 +242,18 @@ class TypeDef(object):
 
     def get_py_type_cls(self):
         """Returns the Python class of the type class if the type is used in a
-        complex type.
+        complex type. It is created once and shared.
         """
-        return NaTypeElement({
-            'name': self.name,
-            'type': self.get_type(),
-            'encrypted': self.encrypted,
-            'is-array': self.is_array,
-            'nonempty': self.nonempty,
-            'is-optional': self.is_optional,
-        })
+        if self._py_type_cls is None:
+            self._py_type_cls = NaTypeElement({
+                'name': self.name,
+                'type': self.get_type(),
+                'encrypted': self.encrypted,
+                'is-array': self.is_array,
+                'nonempty': self.nonempty,
+                'is-optional': self.is_optional,
+            })
+        return self._py_type_cls
 
     def get_py_cls(self, value=None):
         """Returns the Python class for this type."""
@@ -174,14 +278,22 @@ class TypeDef(object):
 class NamedType(object):
     """Class for combined (complex) types."""
 
+    __slots__ = ('name', 'elements', '_py_cls')
+
     def __init__(self, name, elements):
-        self.name = name
+        self.name = intern_name(name)
         self.elements = elements
+        self._py_cls = None
 
     def get_py_cls(self):
-        """Returns the Python class for this type."""
-        elements = [element.get_py_type_cls() for element in self.elements]
-        return NaNamedType(self.name, elements)
+        """Returns the Python class for this type. It is created once and
+        shared.
+        """
+        if self._py_cls is None:
+            elements = [element.get_py_type_cls()
+                        for element in self.elements]
+            self._py_cls = NaNamedType(self.name, elements)
+        return self._py_cls
 
     def duplicate(self):
         """Clone this type."""
@@ -193,6 +305,16 @@ class NamedType(object):
             child.is_output = output
 
 
+def intern_name(name):
+    """Return the interned version of `name`, so equal names are stored
+    once.
+    """
+    try:
+        return _intern(name)
+    except TypeError:
+        return name
+
+
 def dashed_list(a_list):
     """Return human readable version of list with dashes."""
     return '\n'.join([' - %s' % i for i in a_list])
@@ -201,6 +323,9 @@ def dashed_list(a_list):
 class NaArgument(object):
     """Argument class for API calls."""
 
+    __slots__ = ('value', 'name', 'var_type', 'encrypted', 'nonempty',
+                 'is_optional', 'is_array')
+
     def __init__(self, value, settings):
         self.value = value
         self.name = settings['name']
@@ -212,19 +337,7 @@ class NaArgument(object):
 
     def is_set(self):
         """Check if value is set."""
-        if self.var_type in GENERIC_TYPES:
-            if self.var_type is bool or self.var_type is int:
-                return self.value is not None
-            elif self.var_type is str:
-                return self.value is not None and self.value != ''
-            else:
-                raise PyontapiError('unknown type %s' % self.var_type)
-        elif self.is_array:
-            if self.value:
-                return True
-            return False
-        else:
-            return self.var_type.is_set(self.value)
+        return _is_argument_set(self.var_type, self.is_array, self.value)
 
     def append_to_doc(self, doc, api):
         """Append argument values to XML query."""
@@ -253,9 +366,28 @@ class NaArgument(object):
         return str(self.value)
 
 
+def _is_argument_set(var_type, is_array, value):
+    """Check if argument `value` of type `var_type` is set."""
+    if var_type in GENERIC_TYPES:
+        if var_type is bool or var_type is int:
+            return value is not None
+        elif var_type is str:
+            return value is not None and value != ''
+        else:
+            raise PyontapiError('unknown type %s' % var_type)
+    elif is_array:
+        if value:
+            return True
+        return False
+    else:
+        return var_type.is_set(value)
+
+
 class NaField(object):
     """Output field class."""
 
+    __slots__ = ('name', 'var_type', 'encrypted', 'is_array')
+
     def __init__(self, settings):
         self.name = settings['name']
         self.var_type = settings['type']
@@ -297,12 +429,18 @@ class NaField(object):
         except:
             return None
 
+
 class NaNamedType(object):
     """Class for complex ONTAPI types."""
 
+    __slots__ = ('name', 'elements', 'decoder', 'writer')
+
     def __init__(self, name, elements):
         self.name = name
         self.elements = elements
+        # compiled on first use, see ResponseDecoder and RequestSerializer
+        self.decoder = None
+        self.writer = None
 
     def append_to_element(self, doc, value):
         """Append element to `doc`.
@@ -364,6 +502,9 @@ class NaNamedType(object):
 class NaTypeElement(object):
     """Class for complex type elements."""
 
+    __slots__ = ('name', 'var_type', 'encrypted', 'is_array', 'nonempty',
+                 'is_optional')
+
     def __init__(self, settings):
         self.name = settings['name']
         self.var_type = settings['type']
@@ -437,7 +578,11 @@ def _get_generic_type_value(var_type, elem, default=None):
     """
     if not elem.childNodes:
         return default
-    value = elem.childNodes[0].data
+    return _convert_generic_type_value(var_type, elem.childNodes[0].data)
+
+
+def _convert_generic_type_value(var_type, value):
+    """Convert text `value` to generic type `var_type`."""
     if var_type is bool:
         val = value == 'true'
     else:
@@ -457,19 +602,880 @@ def _get_generic_type_value(var_type, elem, default=None):
     return val
 
 
+class RequestSerializer(object):
+    """Serializer for the request element of API command `name`.
+
+    The `arguments` (:class:`NaArgument` instances, their values are not
+    used) are compiled into writers with precomputed tags once.
+    :meth:`serialize` then writes the XML for a list of argument values
+    directly, producing the same XML as :meth:`NaArgument.append_to_doc`.
+    """
+
+    def __init__(self, name, arguments):
+        self.name = name
+        self.arguments = arguments
+        self._writers = [(_compile_argument(arg), arg.var_type,
+                          arg.is_array, arg.is_optional)
+                         for arg in arguments]
+        self._open_tag = '<%s>' % name
+        self._close_tag = '</%s>' % name
+        self._empty_tag = '<%s/>' % name
+
+    def serialize(self, values):
+        """Return the request element for `values` as a string. `values`
+        are the argument values in the order of :attr:`arguments`.
+        """
+        out = [self._open_tag]
+        for (write, var_type, is_array, is_optional), value in \
+                zip(self._writers, values):
+            if not is_optional or _is_argument_set(var_type, is_array, value):
+                write(out, value)
+        if len(out) == 1:
+            return self._empty_tag
+        out.append(self._close_tag)
+        return ''.join(out)
+
+
+def serialize_raw(name, arguments):
+    """Return the request element of API command `name` for the dict
+    `arguments` without using the API schema (see
+    :meth:`schtob.pyontapi.NaFiler.raw_call`).
+
+    Underscores in the keys of `arguments` are replaced by dashes. Dicts
+    are written as child elements, lists as the children of their element,
+    so list items are dicts as well, e.g.
+    ``{'pathname-info': {'name': '/vol/a'}}``. `None` values are skipped.
+    """
+    out = []
+    for key, value in arguments.items():
+        _write_raw(out, key.replace('_', '-'), value)
+    if not out:
+        return _get_tags(name)[2]
+    open_tag, close_tag = _get_tags(name)[:2]
+    return open_tag + ''.join(out) + close_tag
+
+
+def _write_raw(out, name, value):
+    """Write element `name` with `value` (see :func:`serialize_raw`)."""
+    if value is None:
+        return
+    open_tag, close_tag, empty_tag = _get_tags(name)
+    if isinstance(value, dict):
+        items = [value]
+    elif isinstance(value, (list, tuple)):
+        items = value
+    else:
+        out.extend((open_tag, _to_text(value), close_tag))
+        return
+    start = len(out)
+    out.append(open_tag)
+    for item in items:
+        if not isinstance(item, dict):
+            raise TypeError('list items of %s must be dicts, got %r' %
+                            (name, item))
+        for key, child in item.items():
+            _write_raw(out, key, child)
+    if len(out) == start + 1:
+        out[start] = empty_tag
+    else:
+        out.append(close_tag)
+
+
+def escape(value):
+    """Escape `value` for use in XML text and attribute values."""
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace(
+        '"', '&quot;').replace('>', '&gt;')
+
+
+def _to_text(value):
+    """Convert argument `value` to text."""
+    if isinstance(value, str):
+        return escape(value)
+    return escape(str(value))
+
+
+def _write_container(out, open_tag, close_tag, empty_tag, write_children):
+    """Write an element using `write_children`. Returns `False` and writes
+    nothing if `write_children` returns `False`.
+    """
+    start = len(out)
+    out.append(open_tag)
+    if write_children(out) is False:
+        del out[start:]
+        return False
+    if len(out) == start + 1:
+        out[start] = empty_tag
+    else:
+        out.append(close_tag)
+    return True
+
+
+# tags by element name, shared by all writers
+_TAGS = {}
+
+
+def _get_tags(name):
+    """Get opening, closing and empty tag for `name`."""
+    try:
+        return _TAGS[name]
+    except KeyError:
+        tags = _TAGS[name] = ('<%s>' % name, '</%s>' % name, '<%s/>' % name)
+        return tags
+
+
+def _compile_argument(arg):
+    """Compile the writer for argument `arg` (:class:`NaArgument`)."""
+    open_tag, close_tag, empty_tag = _get_tags(arg.name)
+    encrypted = arg.encrypted
+
+    if arg.var_type in GENERIC_TYPES:
+        def write(out, value):
+            if encrypted:
+                raise NotImplementedError('encryption is not supported yet')
+            out.append(open_tag)
+            out.append(_to_text(value))
+            out.append(close_tag)
+            return True
+    elif arg.is_array:
+        write_item = _compile_named_type_writer(arg.var_type)
+
+        def write(out, value):
+            def write_children(out):
+                for item in value:
+                    write_item(out, item)
+            return _write_container(out, open_tag, close_tag, empty_tag,
+                                    write_children)
+    else:
+        write_child = _compile_named_type_writer(arg.var_type)
+
+        def write(out, value):
+            def write_children(out):
+                return write_child(out, value)
+            return _write_container(out, open_tag, close_tag, empty_tag,
+                                    write_children)
+    return write
+
+
+def _compile_named_type_writer(named_type):
+    """Compile the writer for `named_type` (:class:`NaNamedType`). The
+    writer returns `False` if nothing was written. It is kept in
+    :attr:`NaNamedType.writer` and shared by all users of the type.
+    """
+    if named_type.writer is not None:
+        return named_type.writer
+    open_tag, close_tag, empty_tag = _get_tags(named_type.name)
+
+    if len(named_type.elements) == 1 and not named_type.elements[0].name:
+        def write(out, value):
+            if not value:
+                return False
+            out.append(open_tag)
+            out.append(_to_text(value))
+            out.append(close_tag)
+            return True
+        named_type.writer = write
+        return write
+
+    elements = []
+
+    def write(out, value):
+        def write_children(out):
+            for name, write_element in elements:
+                if name in value:
+                    write_element(out, value[name])
+        return _write_container(out, open_tag, close_tag, empty_tag,
+                                write_children)
+    named_type.writer = write
+    for element in named_type.elements:
+        elements.append((element.name,
+                         _compile_type_element_writer(element)))
+    return write
+
+
+def _compile_type_element_writer(element):
+    """Compile the writer for `element` (:class:`NaTypeElement`)."""
+    encrypted = element.encrypted
+
+    if not element.name:
+        def write(out, value):
+            if encrypted:
+                raise NotImplementedError('encryption not supported yet')
+            out.append(_to_text(value))
+            return True
+        return write
+
+    open_tag, close_tag, empty_tag = _get_tags(element.name)
+    name = element.name
+
+    if element.var_type in GENERIC_TYPES:
+        def write(out, value):
+            if encrypted:
+                raise NotImplementedError('encryption not supported yet')
+            out.append(open_tag)
+            out.append(_to_text(value))
+            out.append(close_tag)
+            return True
+    elif element.is_array:
+        write_item = _compile_named_type_writer(element.var_type)
+
+        def write(out, value):
+            def write_children(out):
+                for item in value:
+                    write_item(out, item)
+            return _write_container(out, open_tag, close_tag, empty_tag,
+                                    write_children)
+    else:
+        write_child = _compile_named_type_writer(element.var_type)
+
+        def write(out, value):
+            def write_children(out):
+                write_child(out, value[name])
+            return _write_container(out, open_tag, close_tag, empty_tag,
+                                    write_children)
+    return write
+
+
+class ResponseDecoder(object):
+    """Decoder for the `results` element of an API response.
+
+    The `fields` (:class:`NaField` instances) are compiled into a tree of
+    decoders once. :meth:`decode` then walks the response a single time,
+    dispatching on tag names with dict lookups. The decoders work on
+    start/text/end events, so they can be fed from a DOM tree or directly
+    from a parser.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        decoders = []
+        for field in fields:
+            decoders.append((field.name, _compile_field(field),
+                             _get_field_default(field)))
+        self.root = _StructDecoder(decoders)
+
+    def decode(self, results):
+        """Decode `results` DOM element into a dictionary."""
+        return _decode_node(self.root, results)
+
+
+class RawResponseDecoder(ResponseDecoder):
+    """Decoder for the `results` element of an API response without using
+    the API schema.
+
+    Elements with children are decoded into dictionaries, other elements
+    into their text. Children whose tag occurs more than once are collected
+    into a list, so a list with a single item can't be told apart from a
+    single child.
+    """
+
+    def __init__(self):
+        self.fields = []
+        self.root = _GenericResultsDecoder()
+
+
+class ResponseParser(object):
+    """Incremental parser for API responses.
+
+    The response body is passed to :meth:`feed` in chunks as it arrives.
+    The result dictionary is built on the fly by `decoder`
+    (:class:`ResponseDecoder`); :meth:`close` returns it. If `log` is given
+    and debug logging is enabled, the response is logged. :attr:`size` is
+    the number of bytes fed so far.
+    """
+
+    def __init__(self, decoder, log=None):
+        self._decoder = decoder
+        self.size = 0
+        # the response is decoded as latin1 like pyontapi always did, no
+        # matter which encoding the filer declares
+        self._parser = xml.parsers.expat.ParserCreate('ISO-8859-1')
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._text
+        self._stack = []
+        self._in_root = False
+        self._skip = 0
+        self._result = None
+        self._failure = None
+        self._log = None
+        self._chunks = None
+        if log is not None and log.isEnabledFor(logging.DEBUG):
+            self._log = log
+            self._chunks = []
+
+    def feed(self, data):
+        """Parse the next chunk of the response."""
+        self.size += len(data)
+        if self._chunks is not None:
+            self._chunks.append(data)
+        self._parser.Parse(data, False)
+
+    def close(self):
+        """Finish parsing and return the result dictionary.
+
+        Raises :class:`schtob.pyontapi.errors.APIFailure` if the API call
+        failed.
+        """
+        self._parser.Parse(b'', True)
+        if self._log is not None:
+            self._log.debug('XML response: %s',
+                            b''.join(self._chunks).decode('latin1'))
+        if self._failure is not None:
+            raise APIFailure(self._failure[0], self._failure[1])
+        if self._result is None:
+            raise APIFailure(-1, 'No results in API response')
+        return self._result
+
+    def _start(self, tag, attrs):
+        if self._skip:
+            self._skip += 1
+        elif self._stack:
+            decoder = self._stack[-1][0].child(tag)
+            if decoder is None:
+                self._skip = 1
+            else:
+                self._stack.append((decoder, decoder.start(), tag))
+        elif not self._in_root:
+            self._in_root = True
+        elif tag == 'results' and self._result is None:
+            if attrs.get('status') != 'passed':
+                self._failure = (attrs.get('errno', ''),
+                                 attrs.get('reason', ''))
+                self._skip = 1
+            else:
+                decoder = self._decoder.root
+                self._stack.append((decoder, decoder.start(), tag))
+        else:
+            self._skip = 1
+
+    def _end(self, tag):
+        if self._skip:
+            self._skip -= 1
+        elif self._stack:
+            decoder, state, tag = self._stack.pop()
+            value = decoder.end(state)
+            if self._stack:
+                parent = self._stack[-1]
+                parent[0].add(parent[1], tag, value)
+            else:
+                self._result = value
+
+    def _text(self, data):
+        if self._stack and not self._skip:
+            frame = self._stack[-1]
+            frame[0].text(frame[1], data)
+
+
+def _get_field_default(field):
+    """Get the value of output `field` if it is missing in the response."""
+    if field.is_array:
+        return []
+    elif field.var_type in GENERIC_TYPES:
+        return field.get_content('')
+    return None
+
+
+def _compile_field(field):
+    """Compile the decoder for output `field` (:class:`NaField`)."""
+    if field.is_array:
+        if field.var_type in GENERIC_TYPES:
+            return _ArrayDecoder(_get_scalar_decoder(field.var_type))
+        # empty values are skipped
+        return _ArrayDecoder(_compile_named_type(field.var_type),
+                             field.var_type.name, True)
+    elif field.var_type in GENERIC_TYPES:
+        return _ScalarDecoder(field.var_type, field.get_content,
+                              field.get_content(''))
+    return _compile_named_value(field.var_type)
+
+
+def _compile_named_type(named_type):
+    """Compile the decoder for `named_type` (:class:`NaNamedType`). It is
+    kept in :attr:`NaNamedType.decoder` and shared by all users of the type.
+    """
+    if named_type.decoder is not None:
+        return named_type.decoder
+    if len(named_type.elements) == 1 and not named_type.elements[0].name:
+        named_type.decoder = _TextDecoder()
+    else:
+        named_type.decoder = _StructDecoder()
+        named_type.decoder.set_elements([
+            (element.name, _compile_type_element(element),
+             _get_element_default(element))
+            for element in named_type.elements])
+    return named_type.decoder
+
+
+def _compile_named_value(named_type):
+    """Compile the decoder for a single value of `named_type` in an
+    element which may wrap it into an element named after the type.
+    """
+    decoder = _compile_named_type(named_type)
+    if isinstance(decoder, _StructDecoder):
+        return _WrappedStructDecoder(decoder, named_type.name)
+    return decoder
+
+
+def _get_element_default(element):
+    """Get the value of type `element` if it is missing in the response."""
+    if element.is_array:
+        return []
+    return None
+
+
+def _compile_type_element(element):
+    """Compile the decoder for `element` (:class:`NaTypeElement`)."""
+    if element.is_array:
+        if element.var_type in GENERIC_TYPES:
+            return _ArrayDecoder(_get_scalar_decoder(element.var_type))
+        return _ArrayDecoder(_compile_named_type(element.var_type))
+    elif element.var_type in GENERIC_TYPES:
+        return _get_scalar_decoder(element.var_type)
+    return _compile_named_value(element.var_type)
+
+
+def _decode_node(decoder, node):
+    """Decode DOM `node` using `decoder`."""
+    state = decoder.start()
+    for child in node.childNodes:
+        if child.nodeType == child.ELEMENT_NODE:
+            child_decoder = decoder.child(child.tagName)
+            if child_decoder is not None:
+                decoder.add(state, child.tagName,
+                            _decode_node(child_decoder, child))
+        elif child.nodeType in (child.TEXT_NODE, child.CDATA_SECTION_NODE):
+            decoder.text(state, child.data)
+    return decoder.end(state)
+
+
+class _StructDecoder(object):
+    """Decodes an element with named children into a dictionary.
+
+    `elements` is a list of ``(name, decoder, default)`` tuples. Children
+    without a decoder are skipped; missing children get the `default` value.
+    """
+
+    def __init__(self, elements=()):
+        self.set_elements(elements)
+
+    def set_elements(self, elements):
+        """Set the ``(name, decoder, default)`` tuples."""
+        self._dispatch = {}
+        self._defaults = []
+        for name, decoder, default in elements:
+            self._dispatch[name] = decoder
+            self._defaults.append((name, default))
+
+    def start(self):
+        value = {}
+        for name, default in self._defaults:
+            if isinstance(default, list):
+                default = []
+            value[name] = default
+        return value
+
+    def child(self, tag):
+        return self._dispatch.get(tag)
+
+    def add(self, state, tag, value):
+        state[tag] = value
+
+    def text(self, state, data):
+        pass
+
+    def end(self, state):
+        return state
+
+
+class _WrappedStructDecoder(object):
+    """Decodes an element holding a struct using `decoder`
+    (:class:`_StructDecoder`).
+
+    ONTAPI wraps the struct into an element named `type_tag` after its
+    type, e.g. ``<attributes><volume-info>...</volume-info></attributes>``;
+    the members may also be direct children.
+    """
+
+    def __init__(self, decoder, type_tag):
+        self._decoder = decoder
+        self._type_tag = type_tag
+
+    def start(self):
+        return self._decoder.start()
+
+    def child(self, tag):
+        if tag == self._type_tag:
+            return self._decoder
+        return self._decoder.child(tag)
+
+    def add(self, state, tag, value):
+        if tag == self._type_tag:
+            state.update(value)
+        else:
+            self._decoder.add(state, tag, value)
+
+    def text(self, state, data):
+        pass
+
+    def end(self, state):
+        return state
+
+
+class _ArrayDecoder(object):
+    """Decodes the children of an element into a list.
+
+    If `item_tag` is given, other children are skipped. If `skip_empty` is
+    set, empty values are not added to the list.
+    """
+
+    def __init__(self, item_decoder, item_tag=None, skip_empty=False):
+        self._item_decoder = item_decoder
+        self._item_tag = item_tag
+        self._skip_empty = skip_empty
+
+    def start(self):
+        return []
+
+    def child(self, tag):
+        if self._item_tag is None or tag == self._item_tag:
+            return self._item_decoder
+        return None
+
+    def add(self, state, tag, value):
+        if value or not self._skip_empty:
+            state.append(value)
+
+    def text(self, state, data):
+        pass
+
+    def end(self, state):
+        return state
+
+
+class _GenericDecoder(object):
+    """Decodes any element into a dictionary or its text, see
+    :class:`RawResponseDecoder`.
+    """
+
+    def start(self):
+        return [None, []]
+
+    def child(self, tag):
+        return self
+
+    def add(self, state, tag, value):
+        children = state[0]
+        if children is None:
+            children = state[0] = {}
+        if tag not in children:
+            children[tag] = value
+        elif isinstance(children[tag], list):
+            # values are dicts or text, so lists are repeated children
+            children[tag].append(value)
+        else:
+            children[tag] = [children[tag], value]
+
+    def text(self, state, data):
+        state[1].append(data)
+
+    def end(self, state):
+        if state[0] is None:
+            return ''.join(state[1])
+        return state[0]
+
+
+_GENERIC_DECODER = _GenericDecoder()
+
+
+class _GenericResultsDecoder(_GenericDecoder):
+    """Decodes the `results` element, always into a dictionary."""
+
+    def child(self, tag):
+        return _GENERIC_DECODER
+
+    def end(self, state):
+        if state[0] is None:
+            return {}
+        return state[0]
+
+
+# decoders for generic types without conversion function, shared
+_SCALAR_DECODERS = {}
+
+
+def _get_scalar_decoder(var_type):
+    """Get the :class:`_ScalarDecoder` for generic type `var_type`."""
+    try:
+        return _SCALAR_DECODERS[var_type]
+    except KeyError:
+        decoder = _SCALAR_DECODERS[var_type] = _ScalarDecoder(var_type)
+        return decoder
+
+
+class _ScalarDecoder(object):
+    """Decodes the text of an element into a generic type.
+
+    `convert` is called with the text; `empty` is returned for elements
+    without text.
+    """
+
+    def __init__(self, var_type, convert=None, empty=None):
+        self._var_type = var_type
+        self._convert = convert or self._convert_generic
+        self._empty = empty
+
+    def _convert_generic(self, value):
+        return _convert_generic_type_value(self._var_type, value)
+
+    def start(self):
+        return []
+
+    def child(self, tag):
+        return None
+
+    def add(self, state, tag, value):
+        pass
+
+    def text(self, state, data):
+        state.append(data)
+
+    def end(self, state):
+        if not state:
+            return self._empty
+        return self._convert(''.join(state))
+
+
+class _TextDecoder(_ScalarDecoder):
+    """Decodes the text of an element without conversion."""
+
+    def __init__(self):
+        _ScalarDecoder.__init__(self, str, None, '')
+
+    def end(self, state):
+        return ''.join(state)
+
+
+class PagePrefetcher(object):
+    """Iterate over the page generator `pages` while a background thread
+    already fetches the next pages.
+
+    At most `depth` pages and, unless a single page is larger, at most
+    `max_records` records are read ahead. :meth:`close` stops the thread
+    and closes `pages`.
+    """
+
+    def __init__(self, pages, depth, max_records):
+        self._pages = pages
+        self._depth = depth
+        self._max_records = max_records
+        self._buffer = collections.deque()
+        self._records = 0
+        self._error = None
+        self._done = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """Return the next page."""
+        self._condition.acquire()
+        try:
+            while not self._buffer and not self._done:
+                self._condition.wait()
+            if self._buffer:
+                page = self._buffer.popleft()
+                self._records -= len(page)
+                self._condition.notify_all()
+                return page
+            if self._error is not None:
+                error, self._error = self._error, None
+                raise error
+            raise StopIteration
+        finally:
+            self._condition.release()
+
+    __next__ = next
+
+    def close(self):
+        """Stop reading ahead and close the page generator."""
+        self._condition.acquire()
+        try:
+            self._closed = True
+            self._condition.notify_all()
+        finally:
+            self._condition.release()
+        self._thread.join()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        """Fetch pages until all are read or :meth:`close` is called."""
+        try:
+            try:
+                for page in self._pages:
+                    if not self._put(page):
+                        break
+            finally:
+                self._pages.close()
+        except Exception:
+            self._error = sys.exc_info()[1]
+        self._condition.acquire()
+        try:
+            self._done = True
+            self._condition.notify_all()
+        finally:
+            self._condition.release()
+
+    def _put(self, page):
+        """Buffer `page` and wait for room for the next one. Returns `False`
+        if :meth:`close` was called.
+        """
+        self._condition.acquire()
+        try:
+            self._buffer.append(page)
+            self._records += len(page)
+            self._condition.notify_all()
+            while not self._closed and (
+                    len(self._buffer) >= self._depth or
+                    self._records >= self._max_records):
+                self._condition.wait()
+            return not self._closed
+        finally:
+            self._condition.release()
+
+
 class BaseAPI(object):
-    """Base class for all ONTAPI classes."""
+    """Base class for all ONTAPI classes.
 
-    def __init__(self, filer, commands=None):
+    The API commands are either added as instance methods or, for classes
+    created by :meth:`for_commands`, defined as class methods shared by all
+    instances.
+    """
+
+    # add generators for iterator style API commands
+    paginate = True
+
+    # API commands defined by :meth:`for_commands` or binding modules;
+    # `py_name`: `APICommand` (or :class:`bindings.Command`) and
+    # `command_name`: `py_name`
+    _class_commands = {}
+    _class_command_names = {}
+
+    def __init__(self, filer, commands=None, command_names=None):
         self._filer = filer
         self._commands = {}
         self._api_methods = {}
+        # commands which are generated on first use; `py_name`: `api_name`
+        # and `command_name`: `api_name`
+        self._lazy_py_names = {}
+        self._lazy_names = {}
+        self._lazy_lock = None
+        if command_names:
+            self._lazy_lock = threading.Lock()
         if not commands:
             commands = []
         self.__add_commands(commands)
+        for name in command_names or ():
+            command = APICommand(name, ())
+            self._lazy_py_names[command.get_py_name()] = name
+            self._lazy_names[command.get_command_name()] = name
+        if self.paginate and (commands or command_names):
+            iterators = self.get_iterators(
+                [command.name for command in commands] +
+                list(command_names or ()))
+            for py_name, function in iterators.items():
+                if py_name not in self.__dict__ and \
+                        py_name not in self._lazy_py_names and \
+                        not hasattr(type(self), py_name):
+                    setattr(self, py_name, types.MethodType(function, self))
+
+    def for_commands(cls, name, commands):
+        """Create a subclass `name` with a method for each of the
+        :class:`APICommand` instances in `commands`. The commands are shared
+        by all instances of the subclass.
+        """
+        namespace = {}
+        if cls.paginate:
+            namespace.update(
+                cls.get_iterators([command.name for command in commands]))
+        namespace['_class_commands'], namespace['_class_command_names'] = \
+            get_class_commands(commands)
+        for command in commands:
+            namespace[command.get_py_name()] = _make_api_method(command)
+        return type(str(name), (cls,), namespace)
+
+    for_commands = classmethod(for_commands)
+
+    def _invoke(self, py_name, values, deadline=None):
+        """Invoke the API command `py_name` of this class using the argument
+        `values` in the order of the plan's argument names. Used by the
+        methods of generated binding modules.
+        """
+        plan = self._class_commands[py_name].get_plan()
+        return self._filer.do_api_request(
+            plan.name, plan.serializer.serialize(values), plan.decoder,
+            deadline)
+
+    def _invoke_keywords(self, py_name, args, kwargs):
+        """Invoke the API command `py_name` of this class using `kwargs` as
+        arguments. Used by the methods of generated binding modules whose
+        argument names can't be Python parameters.
+        """
+        if args:
+            raise RuntimeError(
+                'API commands accept only keyword arguments!'
+            )
+        plan = self._class_commands[py_name].get_plan()
+        deadline = pop_deadline(kwargs, plan.valid_names)
+        return self._filer.do_api_request(
+            plan.name, plan.get_request(kwargs), plan.decoder, deadline)
+
+    def __getattr__(self, name):
+        # only called if there is no such attribute: generate lazy commands
+        # on first access
+        lazy_py_names = self.__dict__.get('_lazy_py_names')
+        if lazy_py_names is None:
+            raise AttributeError(name)
+        api_name = lazy_py_names.get(name)
+        if api_name is not None:
+            self.__generate_command(api_name)
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __generate_command(self, api_name):
+        """Generate the lazy command `api_name` unless another thread already
+        did.
+        """
+        command = APICommand(api_name, ())
+        self._lazy_lock.acquire()
+        try:
+            if command.get_py_name() not in self._lazy_py_names:
+                return
+            for generated in self._filer._generate_commands([api_name]):
+                self.__add_command(generated)
+            self._lazy_py_names.pop(command.get_py_name(), None)
+            self._lazy_names.pop(command.get_command_name(), None)
+        finally:
+            self._lazy_lock.release()
 
     def get_command(self, name):
         """Get command by `name`."""
+        if name in self._api_methods:
+            return self._api_methods[name]
+        if name in self._class_command_names:
+            return getattr(self, self._class_command_names[name])
+        api_name = self._lazy_names.get(name)
+        if api_name is not None:
+            self.__generate_command(api_name)
         return self._api_methods[name]
 
     def invoke_command(self, command, **kwargs):
@@ -482,14 +1488,179 @@ class BaseAPI(object):
 
     def get_commands(self):
         """Return List of command names."""
-        return self._commands.keys()
+        return list(self._class_commands.keys()) + \
+            list(self._commands.keys()) + list(self._lazy_py_names.keys())
 
     def get_command_info(self, command):
         """Get information about command."""
-        if command not in self._commands:
+        if command not in self._class_commands and \
+                command not in self._commands and \
+                command not in self._lazy_py_names:
             raise KeyError('No such command')
         return getattr(self, command).__doc__
 
+    def get_iterators(cls, api_names):
+        """Get generator functions for the iterator style commands in
+        `api_names`: `<package>-<name>-get-iter` becomes ``iter_<name>_get``
+        and `<package>-<name>-iter-start/next/end` becomes ``iter_<name>``.
+        Returns a dict mapping the method names to the functions.
+        """
+        api_names = set(api_names)
+        iterators = {}
+        for api_name in api_names:
+            if api_name.endswith('-get-iter'):
+                py_name = 'iter_' + APICommand(api_name, ()).get_py_name()[:-5]
+                function = cls.__get_tag_iterator(api_name)
+            elif api_name.endswith('-iter-start') and \
+                    api_name.count('-') > 2:
+                base_name = api_name[:-len('-iter-start')]
+                if base_name + '-iter-next' not in api_names:
+                    continue
+                end_name = base_name + '-iter-end'
+                if end_name not in api_names:
+                    end_name = None
+                py_name = 'iter_' + APICommand(base_name, ()).get_py_name()
+                function = cls.__get_session_iterator(
+                    api_name, base_name + '-iter-next', end_name)
+            else:
+                continue
+            function.__name__ = str(py_name)
+            iterators[py_name] = function
+        return iterators
+
+    get_iterators = classmethod(get_iterators)
+
+    def __get_api_command(self, api_name):
+        """Get the :class:`APICommand` for `api_name`."""
+        py_name = APICommand(api_name, ()).get_py_name()
+        if py_name in self._class_commands:
+            return self._class_commands[py_name]
+        return self._commands[py_name]
+
+    def __get_records_field(self, api_name):
+        """Get the name of the array output field of `api_name` which holds
+        the records.
+        """
+        plan = self.__get_api_command(api_name).get_plan()
+        names = [field.name for field in plan.decoder.fields
+                 if field.is_array]
+        if 'attributes-list' in names:
+            return 'attributes-list'
+        if len(names) != 1:
+            raise PyontapiError(-1, "Can't find the records of %s" %
+                                api_name)
+        return names[0]
+
+    def __get_page_size(self, page_size):
+        """Get `page_size` or the page size of the filer."""
+        if page_size is None:
+            return self._filer.settings['page_size']
+        return page_size
+
+    def __iter_records(self, pages):
+        """Yield the records of the page generator `pages`, reading ahead
+        if setting **prefetch_pages** is set.
+        """
+        settings = self._filer.settings
+        if settings.get('prefetch_pages'):
+            pages = PagePrefetcher(pages, settings['prefetch_pages'],
+                                   settings['prefetch_max_records'])
+        try:
+            for page in pages:
+                for record in page:
+                    yield record
+        finally:
+            pages.close()
+
+    def __get_tag_iterator(cls, api_name):
+        """Return a generator function for the `*-get-iter` command
+        `api_name`.
+        """
+        command_name = APICommand(api_name, ()).get_command_name()
+
+        def get_pages(fun, field, kwargs, expires):
+            """Yield the pages of records."""
+            while True:
+                result = fun(deadline=get_remaining(expires), **kwargs)
+                yield result.get(field) or []
+                if not result.get('next-tag'):
+                    break
+                kwargs['tag'] = result['next-tag']
+
+        def inner(self, page_size=None, deadline=None, **kwargs):
+            """Iterate API command."""
+            kwargs.setdefault('max_records', self.__get_page_size(page_size))
+            return self.__iter_records(get_pages(
+                self.get_command(command_name),
+                self.__get_records_field(api_name), kwargs,
+                get_expires(deadline)))
+
+        inner.__doc__ = """Yield the records of API command `%s` page by page.
+
+`page_size` records (default: setting **page_size**) are requested per call
+unless `max_records` is given. All pages must be fetched within `deadline`
+seconds, if given. All other keyword arguments are passed to `%s`.
+""" % (api_name, api_name)
+        return inner
+
+    __get_tag_iterator = classmethod(__get_tag_iterator)
+
+    def __get_session_iterator(cls, start_name, next_name, end_name):
+        """Return a generator function for the iterator session commands
+        `start_name`, `next_name` and `end_name` (may be `None`).
+        """
+        start_command = APICommand(start_name, ()).get_command_name()
+        next_command = APICommand(next_name, ()).get_command_name()
+
+        def get_pages(start_fun, next_fun, end_fun, field, maximum, kwargs,
+                      expires):
+            """Yield the pages of records."""
+            tag = start_fun(deadline=get_remaining(expires), **kwargs)['tag']
+            try:
+                while True:
+                    records = next_fun(
+                        tag=tag, maximum=maximum,
+                        deadline=get_remaining(expires)).get(field)
+                    if not records:
+                        break
+                    yield records
+            finally:
+                # also ends the session if the consumer stops early; a
+                # failure must not replace the exception being raised
+                if end_fun is not None:
+                    try:
+                        end_fun(tag=tag, deadline=get_remaining(expires))
+                    except APIFailure:
+                        logging.getLogger('pyontapi').warning(
+                            'Cannot end iterator session %s of %s: %s', tag,
+                            start_name, sys.exc_info()[1].reason)
+
+        def inner(self, page_size=None, deadline=None, **kwargs):
+            """Iterate API commands."""
+            end_fun = None
+            if end_name is not None:
+                end_fun = self.get_command(
+                    APICommand(end_name, ()).get_command_name())
+            return self.__iter_records(get_pages(
+                self.get_command(start_command),
+                self.get_command(next_command), end_fun,
+                self.__get_records_field(next_name),
+                self.__get_page_size(page_size), kwargs,
+                get_expires(deadline)))
+
+        inner.__doc__ = """Yield the records of API commands
+`%s`/`-next`/`-end` page by page.
+
+`page_size` records (default: setting **page_size**) are requested per call.
+All calls must finish within `deadline` seconds, if given. All other keyword
+arguments are passed to `%s`. The iterator session is ended when the
+generator is exhausted or closed; if that fails, e.g. because the deadline
+has passed, a warning is logged and the session is left to the filer.
+""" % (start_name, start_name)
+        return inner
+
+    __get_session_iterator = classmethod(__get_session_iterator)
+
     def __add_commands(self, commands):
         """Adds instance methods for each API command."""
         for command in commands:
@@ -498,36 +1669,46 @@ class BaseAPI(object):
     def __add_command(self, command):
         """Add instance method for API command."""
         self._commands[command.get_py_name()] = command
+        method = types.MethodType(_make_api_method(command), self)
+        setattr(self, command.get_py_name(), method)
+        self._api_methods[command.get_command_name()] = method
 
-        def inner(*args, **kwargs):
-            """Invoke API command."""
-            if args:
-                raise RuntimeError(
-                    'API commands accept only keyword arguments!'
-                )
-            arguments = []
-            output_fields = []
-            keys = []
-            for arg in command.get_arguments():
-                field = arg.get_py_cls(
-                    kwargs.get(arg.name_to_py(), arg.get_default())
-                )
-                if arg.name_to_py() in kwargs:
-                    keys.append(arg.name_to_py())
-                arguments.append(field)
-            for field in command.get_output_fields():
-                field = field.get_py_cls()
-                output_fields.append(field)
-            for key in kwargs:
-                if key not in keys:
-                    raise TypeError("%s() got an unexpected keyword "
-                                    "argument '%s'" % (command.get_py_name(),
-                                                       key))
-            return self._filer.do_api_call(command.name, arguments,
-                                           output_fields)
-
-        inner.func_name = str(command.get_py_name())
-        inner.__doc__ = """Invoke API command `%(api)s`.
+
+def get_class_commands(commands):
+    """Get the :attr:`BaseAPI._class_commands` and
+    :attr:`BaseAPI._class_command_names` dicts for `commands`.
+    """
+    class_commands = {}
+    class_command_names = {}
+    for command in commands:
+        class_commands[command.get_py_name()] = command
+        class_command_names[command.get_command_name()] = \
+            command.get_py_name()
+    return class_commands, class_command_names
+
+
+def _make_api_method(command):
+    """Return the method invoking API command `command`."""
+
+    def inner(self, *args, **kwargs):
+        """Invoke API command."""
+        if args:
+            raise RuntimeError(
+                'API commands accept only keyword arguments!'
+            )
+        plan = command.get_plan()
+        deadline = pop_deadline(kwargs, plan.valid_names)
+        return self._filer.do_api_request(
+            plan.name, plan.get_request(kwargs), plan.decoder, deadline)
+
+    inner.__name__ = str(command.get_py_name())
+    inner.__doc__ = get_command_doc(command)
+    return inner
+
+
+def get_command_doc(command):
+    """Get the docstring of the method for API command `command`."""
+    return """Invoke API command `%(api)s`.
 
 Required Arguments:
 %(required_args)s
@@ -538,11 +1719,8 @@ Optional Arguments:
 Output Fields:
 %(output_fields)s
 """ % {
-            'api': command.name,
-            'required_args': dashed_list(command.get_required_args()),
-            'optional_args': dashed_list(command.get_optional_args()),
-            'output_fields': dashed_list(command.get_output_fields_and_types())
-        }
-
-        setattr(self, command.get_py_name(), inner)
-        self._api_methods[command.get_command_name()] = inner
+        'api': command.name,
+        'required_args': dashed_list(command.get_required_args()),
+        'optional_args': dashed_list(command.get_optional_args()),
+        'output_fields': dashed_list(command.get_output_fields_and_types())
+    }
@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+"""
+    schtob.pyontapi.bindings
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Static binding modules: Python modules with one API class per package,
+    generated out of the results of `system-api-list-types` and
+    `system-api-get-elements`. A :class:`schtob.pyontapi.NaFiler` with the
+    setting `bindings` uses the module matching its server type and ONTAPI
+    version instead of generating the API classes at runtime.
+
+    Each API command is a method with the command's arguments as
+    parameters. The data of its
+    :class:`schtob.pyontapi.api.InvocationPlan` (argument names, defaults,
+    argument and output field descriptors) and the named types are written
+    as literals; the plans are compiled out of them on first use.
+
+    Use ``bin/pyontapi_generate_bindings.py`` to write the modules.
+
+    :copyright: 2010-2015 Schaefer & Tobies SuC GmbH.
+    :author: Markus Grimm <mgr@schaefer-tobies.de>;
+             Uwe W. Schaefer <uws@schaefer-tobies.de>
+    :license: LGPL, see LICENSE for details.
+"""
+
+import keyword
+import logging
+import os
+import pprint
+import re
+import sys
+import textwrap
+import threading
+
+from schtob.pyontapi import api, py_gen
+
+# Version of the generated module layout.
+FORMAT = 2
+
+# Names of the generic types, see :data:`schtob.pyontapi.api.GENERIC_TYPEDEFS`.
+GENERIC_NAMES = dict([(value, key)
+                      for key, value in api.GENERIC_TYPEDEFS.items()])
+
+# Python identifiers; argument names must match to become parameters.
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# Most parameters of a method; Python < 3.7 allows at most 255 arguments.
+MAX_PARAMETERS = 250
+
+# Names which cannot be used as method names in Python 2 or 3.
+RESERVED_NAMES = frozenset(keyword.kwlist + [
+    'exec', 'print', 'nonlocal', 'None', 'True', 'False', 'async', 'await',
+])
+
+
+def get_module_name(server_type, ontapi_version):
+    """Get the name of the binding module for `server_type` and
+    `ontapi_version`, e.g. ``filer_1_21``.
+    """
+    return '%s_%s' % (server_type.lower(), ontapi_version.replace('.', '_'))
+
+
+def load(package, server_type, ontapi_version):
+    """Import the binding module for `server_type` and `ontapi_version` out
+    of the Python package `package`. Returns `None` if there is no such
+    module or it was written for another :data:`FORMAT`.
+    """
+    name = '%s.%s' % (package, get_module_name(server_type, ontapi_version))
+    try:
+        module = __import__(name, {}, {}, ['API_CLASSES'])
+    except ImportError:
+        logging.getLogger('pyontapi').debug(
+            'No binding module %s: %s', name, sys.exc_info()[1])
+        return None
+    except Exception:
+        # modules of older formats use helpers which are gone
+        logging.getLogger('pyontapi').warning(
+            'Cannot import binding module %s: %s', name, sys.exc_info()[1])
+        return None
+    if getattr(module, 'FORMAT', None) != FORMAT:
+        logging.getLogger('pyontapi').warning(
+            'Binding module %s has an unsupported format', name)
+        return None
+    return module
+
+
+def get_api_classes(module, base_class):
+    """Get the API classes of the binding `module` as subclasses of
+    `base_class`, e.g. :class:`schtob.pyontapi.na_async.AsyncBaseAPI`.
+    Returns a dict mapping package names to classes. The classes are
+    derived once per module and base class.
+    """
+    if base_class is api.BaseAPI:
+        return module.API_CLASSES
+    key = (module.__name__, base_class)
+    _derived_classes_lock.acquire()
+    try:
+        if key not in _derived_classes:
+            api_classes = {}
+            for package_name, api_class in module.API_CLASSES.items():
+                api_classes[package_name] = derive_class(api_class,
+                                                         base_class)
+            _derived_classes[key] = api_classes
+        return _derived_classes[key]
+    finally:
+        _derived_classes_lock.release()
+
+
+def derive_class(api_class, base_class):
+    """Get a copy of the generated `api_class` deriving from `base_class`
+    instead of :class:`schtob.pyontapi.api.BaseAPI`. The generators for
+    iterator style commands are added only if `base_class` paginates.
+    """
+    commands = api_class._class_commands
+    names = [command.name for command in commands.values()]
+    skipped = set(['__dict__', '__weakref__'])
+    for name in api.BaseAPI.get_iterators(names):
+        if name not in commands:
+            skipped.add(name)
+    namespace = {}
+    for name, value in api_class.__dict__.items():
+        if name not in skipped:
+            namespace[name] = value
+    derived = type(api_class.__name__, (base_class,), namespace)
+    if base_class.paginate:
+        for name, function in base_class.get_iterators(names).items():
+            if name not in namespace:
+                setattr(derived, name, function)
+    return derived
+
+
+# API classes of binding modules for other base classes, see
+# get_api_classes().
+_derived_classes = {}
+_derived_classes_lock = threading.Lock()
+
+
+class TypeTable(object):
+    """The named types of a binding module. `entries` maps type names to
+    tuples of element descriptors, see :meth:`get_settings`.
+
+    The :class:`schtob.pyontapi.api.NaNamedType` instances are created on
+    first use and shared by all commands of the module.
+    """
+
+    def __init__(self, entries):
+        self._entries = entries
+        self._types = {}
+        self._lock = threading.RLock()
+
+    def get_type(self, type_name):
+        """Get the Python type of generic type `type_name` or the
+        :class:`schtob.pyontapi.api.NaNamedType` of named type `type_name`.
+        """
+        if type_name in api.GENERIC_TYPEDEFS:
+            return api.GENERIC_TYPEDEFS[type_name]
+        self._lock.acquire()
+        try:
+            named_type = self._types.get(type_name)
+            if named_type is None:
+                # registered before its elements, which may refer to it
+                named_type = self._types[type_name] = api.NaNamedType(
+                    type_name, [])
+                named_type.elements = [
+                    api.NaTypeElement(self.get_settings(element))
+                    for element in self._entries[type_name]]
+            return named_type
+        finally:
+            self._lock.release()
+
+    def get_settings(self, descriptor):
+        """Get the settings of :class:`schtob.pyontapi.api.NaArgument`,
+        :class:`schtob.pyontapi.api.NaField` or
+        :class:`schtob.pyontapi.api.NaTypeElement` for `descriptor`, a
+        ``(name, type_name, is_array, encrypted)`` tuple, followed by
+        ``nonempty`` and ``is_optional`` except for output fields.
+        """
+        settings = {
+            'name': descriptor[0],
+            'type': self.get_type(descriptor[1]),
+            'is-array': descriptor[2],
+            'encrypted': descriptor[3],
+        }
+        if len(descriptor) > 4:
+            settings['nonempty'] = descriptor[4]
+            settings['is-optional'] = descriptor[5]
+        return settings
+
+
+class Command(object):
+    """API command `name` of a binding module, standing in for
+    :class:`schtob.pyontapi.api.APICommand` in the ``_class_commands`` of
+    the generated classes.
+
+    Holds the literal data of its
+    :class:`schtob.pyontapi.api.InvocationPlan`: the Python
+    `argument_names` with their `defaults` and the descriptors of the
+    `arguments` and output `fields` (see :meth:`TypeTable.get_settings`),
+    whose types are looked up in `types` (:class:`TypeTable`).
+    """
+
+    __slots__ = ('name', 'py_name', 'argument_names', 'defaults',
+                 'arguments', 'fields', '_types', '_plan')
+
+    def __init__(self, types, name, py_name, argument_names, defaults,
+                 arguments, fields):
+        self.name = name
+        self.py_name = py_name
+        self.argument_names = argument_names
+        self.defaults = defaults
+        self.arguments = arguments
+        self.fields = fields
+        self._types = types
+        self._plan = None
+
+    def get_plan(self):
+        """Get the :class:`schtob.pyontapi.api.InvocationPlan` of this API
+        command. The plan is compiled on first use.
+        """
+        if self._plan is None:
+            get_settings = self._types.get_settings
+            self._plan = api.InvocationPlan(
+                self.name, self.py_name, self.argument_names, self.defaults,
+                [api.NaArgument(None, get_settings(argument))
+                 for argument in self.arguments],
+                [api.NaField(get_settings(field)) for field in self.fields])
+        return self._plan
+
+
+def setup_class(api_class, renamed):
+    """Finish the generated `api_class`: add the generators for iterator
+    style commands and the methods whose names are reserved in Python.
+    `renamed` maps these names to the names they were generated as.
+    """
+    for name, generated_name in renamed.items():
+        setattr(api_class, name, api_class.__dict__[generated_name])
+    if api_class.paginate:
+        iterators = api_class.get_iterators(
+            [command.name for command in api_class._class_commands.values()])
+        for name, function in iterators.items():
+            if name not in api_class.__dict__:
+                setattr(api_class, name, function)
+
+
+def generate_module(types, elements, server_type, ontapi_version):
+    """Return the source of the binding module for the `types`
+    (`system-api-list-types`) and `elements` (`system-api-get-elements`)
+    results of a filer of `server_type` with `ontapi_version`.
+    """
+    catalog = py_gen.APICatalog(types, elements)
+    named_types = {}
+    class_sources = []
+    class_names = {}
+    for package_name in sorted(catalog.packages):
+        class_name = get_class_name(package_name)
+        class_names[package_name] = class_name
+        class_sources.append(get_class_source(
+            class_name, package_name, catalog.packages[package_name],
+            named_types))
+
+    lines = [
+        '# -*- coding: utf-8 -*-',
+        '"""',
+        '    Pyontapi bindings for ONTAPI version %s of server type %s.' % (
+            ontapi_version, server_type),
+        '',
+        '    Generated by pyontapi_generate_bindings.py, do not edit.',
+        '"""',
+        '',
+        'from schtob.pyontapi import api, bindings',
+        '',
+        'FORMAT = %r' % FORMAT,
+        'SERVER_TYPE = %r' % str(server_type),
+        'ONTAPI_VERSION = %r' % str(ontapi_version),
+        '',
+        '# named types: name: (name, type, is_array, encrypted, nonempty,',
+        '# is_optional) of each element',
+        'TYPES = bindings.TypeTable({',
+    ]
+    for name in sorted(named_types):
+        lines.append('    %r: %s,' % (
+            name, format_items(named_types[name], 4)))
+    lines.append('})')
+    lines.extend(class_sources)
+    lines.extend(['', '', 'API_CLASSES = {'])
+    for package_name in sorted(class_names):
+        lines.append('    %r: %s,' % (str(package_name),
+                                      class_names[package_name]))
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def get_class_source(class_name, package_name, commands, named_types):
+    """Return the source lines of API class `class_name` with the
+    :class:`schtob.pyontapi.api.APICommand` instances `commands` of package
+    `package_name`. The named types they use are added to `named_types`.
+    """
+    commands = sorted(commands, key=lambda command: command.get_py_name())
+    lines = [
+        '',
+        '',
+        'class %s(api.BaseAPI):' % class_name,
+        '    """API commands of package `%s`."""' % package_name,
+        '',
+        '    _class_commands = {',
+    ]
+    for command in commands:
+        arguments = list(command.get_arguments())
+        fields = list(command.get_output_fields())
+        lines.extend([
+            '        %r: bindings.Command(' % str(command.get_py_name()),
+            '            TYPES, %r, %r,' % (
+                str(command.name), str(command.get_py_name())),
+            format_literal(tuple([str(arg.name_to_py())
+                                  for arg in arguments]), 12) + ',',
+            format_literal(tuple([arg.get_default()
+                                  for arg in arguments]), 12) + ',',
+            '            %s,' % format_items(
+                [get_descriptor(arg, named_types) for arg in arguments], 12),
+            '            %s),' % format_items(
+                [get_descriptor(field, named_types) for field in fields],
+                12),
+        ])
+    lines.extend(['    }', '    _class_command_names = {'])
+    for command in commands:
+        lines.append('        %r: %r,' % (str(command.get_command_name()),
+                                          str(command.get_py_name())))
+    lines.append('    }')
+
+    renamed = {}
+    for command in commands:
+        py_name = command.get_py_name()
+        method_name = py_name
+        if py_name in RESERVED_NAMES:
+            method_name = renamed[py_name] = '_api_%s' % py_name
+        lines.append('')
+        lines.extend(get_method_source(command, method_name))
+    lines.extend([
+        '',
+        '',
+        'bindings.setup_class(%s, %s)' % (class_name,
+                                          pprint.pformat(renamed)),
+    ])
+    return '\n'.join(lines)
+
+
+def get_method_source(command, method_name):
+    """Return the source lines of method `method_name` invoking API command
+    `command`. Its arguments become parameters with their defaults, followed
+    by `deadline`, unless their names can't be used as Python parameters.
+    """
+    py_name = str(command.get_py_name())
+    doc = '        """%s"""' % escape_docstring(api.get_command_doc(command))
+    arguments = list(command.get_arguments())
+    names = [str(arg.name_to_py()) for arg in arguments]
+    if not has_parameter_names(names):
+        return [
+            '    def %s(self, *args, **kwargs):' % method_name,
+            doc,
+            '        return self._invoke_keywords(%r, args, kwargs)' %
+            py_name,
+        ]
+
+    parameters = ['self']
+    for name, arg in zip(names, arguments):
+        parameters.append('%s=%r' % (name, arg.get_default()))
+    deadline = 'deadline'
+    if 'deadline' in names:
+        # the argument hides the keyword, see api.pop_deadline()
+        deadline = 'None'
+    else:
+        parameters.append('deadline=None')
+    values = ', '.join(names)
+    if len(names) == 1:
+        values += ','
+    return [
+        wrap('    def %s(' % method_name, ', '.join(parameters) + '):'),
+        doc,
+        wrap('        return self._invoke(',
+             '%r, (%s), %s)' % (py_name, values, deadline)),
+    ]
+
+
+def has_parameter_names(names):
+    """Check if the Python argument `names` can be used as parameters."""
+    if len(names) > MAX_PARAMETERS or len(set(names)) != len(names):
+        return False
+    for name in names:
+        if not IDENTIFIER.match(name) or name in RESERVED_NAMES or \
+                name == 'self':
+            return False
+    return True
+
+
+def get_descriptor(typedef, named_types):
+    """Get the descriptor of argument, output field or type element
+    `typedef` (:class:`schtob.pyontapi.api.TypeDef`), see
+    :meth:`TypeTable.get_settings`. Its named type and the ones this refers
+    to are added to `named_types`.
+    """
+    if typedef.is_generic():
+        type_name = GENERIC_NAMES[typedef.var_type]
+    else:
+        type_name = str(typedef.var_type.name)
+        add_named_type(typedef.var_type, named_types)
+    descriptor = (str(typedef.name or ''), type_name,
+                  bool(typedef.is_array), bool(typedef.encrypted))
+    if typedef.is_output:
+        return descriptor
+    return descriptor + (bool(typedef.nonempty),
+                         bool(typedef.is_optional))
+
+
+def add_named_type(named_type, named_types):
+    """Add the element descriptors of `named_type`
+    (:class:`schtob.pyontapi.api.NamedType`) and the named types it uses to
+    `named_types`.
+    """
+    name = str(named_type.name)
+    if name in named_types:
+        return
+    # registered before its elements, which may refer to it
+    named_types[name] = ()
+    elements = []
+    for element in named_type.elements:
+        descriptor = get_descriptor(element, named_types)
+        if len(descriptor) == 4:
+            # elements are written like arguments
+            descriptor += (bool(element.nonempty), bool(element.is_optional))
+        elements.append(descriptor)
+    named_types[name] = tuple(elements)
+
+
+def wrap(head, text):
+    """Return `text` following `head`, wrapped at spaces to 79 columns and
+    indented to align with the end of `head`.
+    """
+    return '\n'.join(textwrap.wrap(
+        text, 79, initial_indent=head,
+        subsequent_indent=' ' * len(head), break_long_words=False,
+        break_on_hyphens=False))
+
+
+def format_items(items, width):
+    """Return the literal of the tuple `items` with one item per line,
+    indented by `width` spaces.
+    """
+    if not items:
+        return '()'
+    lines = ['(']
+    for item in items:
+        lines.append('%s    %r,' % (' ' * width, item))
+    lines.append('%s)' % (' ' * width))
+    return '\n'.join(lines)
+
+
+def format_literal(value, width):
+    """Return the literal of `value` indented by `width` spaces."""
+    text = pprint.pformat(value, width=79 - width)
+    return ' ' * width + text.replace('\n', '\n' + ' ' * width)
+
+
+def write_module(directory, types, elements, server_type, ontapi_version):
+    """Write the binding module for the given schema into `directory` and
+    return its path. An empty ``__init__.py`` is created if `directory` is
+    no Python package yet.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    init_path = os.path.join(directory, '__init__.py')
+    if not os.path.exists(init_path):
+        open(init_path, 'w').close()
+
+    path = os.path.join(directory, '%s.py' % get_module_name(
+        server_type, ontapi_version))
+    source = generate_module(types, elements, server_type, ontapi_version)
+    handle = open(path, 'wb')
+    try:
+        handle.write(source.encode('utf-8'))
+    finally:
+        handle.close()
+    return path
+
+
+def get_class_name(package_name):
+    """Get the name of the API class for `package_name`."""
+    name = ''.join([bit.capitalize() for bit in
+                    package_name.replace('-', '_').split('_')]) + 'API'
+    if not name[0].isalpha():
+        name = 'API' + name
+    return name
+
+
+def escape_docstring(doc):
+    """Escape `doc` for use in a triple quoted string."""
+    return doc.replace('\\', '\\\\').replace('"""', '\\"\\"\\"')
@@ -68,5 +68,43 @@ class UnknownCommandError(APIFailure):
     pass
 
 
+class APITimeoutError(APIFailure):
+    """API call did not finish in time."""
+    pass
+
+
+class DeadlineExceededError(APITimeoutError):
+    """API call did not finish before its `deadline`. `unanswered` is set if
+    the deadline passed while connecting to the filer or waiting for its
+    answer.
+    """
+
+    def __init__(self, errno, reason, unanswered=False):
+        APITimeoutError.__init__(self, errno, reason)
+        self.unanswered = unanswered
+
+
+class ConnectionFailure(APIFailure):
+    """Connecting to the filer failed or the connection broke."""
+
+    def __init__(self, reason):
+        APIFailure.__init__(self, -1, reason)
+
+
+class HTTPStatusError(APIFailure):
+    """The filer answered with an HTTP result status other than 200."""
+
+    def __init__(self, status, reason):
+        APIFailure.__init__(self, 13002, reason)
+        self.status = status
+
+
+class CircuitOpenError(APIFailure):
+    """The filer is considered down, the call was not sent."""
+
+    def __init__(self, reason):
+        APIFailure.__init__(self, -1, reason)
+
+
 class CertificateError(PyontapiError):
     """Server certificate verification failed."""
@@ -0,0 +1,676 @@
+# -*- coding: utf-8 -*-
+"""
+    schtob.pyontapi.na_async
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    asyncio based counterpart of :class:`schtob.pyontapi.NaFiler`. All API
+    commands are coroutines, so a single event loop can keep requests to many
+    filers in flight::
+
+        >>> filer = await AsyncNaFiler.create('my-filer', settings)
+        >>> result = await filer.volume.list_info()
+
+    API generation is awaitable as well; connecting to many filers overlaps::
+
+        >>> filers = await asyncio.gather(*[
+        ...     AsyncNaFiler.create(name, settings) for name in names])
+
+    Requires Python 3.5 or newer.
+
+    :copyright: 2010-2015 Schaefer & Tobies SuC GmbH.
+    :author: Markus Grimm <mgr@schaefer-tobies.de>;
+             Uwe W. Schaefer <uws@schaefer-tobies.de>
+    :license: LGPL, see LICENSE for details.
+"""
+
+import asyncio
+import ssl
+import time
+
+from schtob.pyontapi import api, constants, errors, na_filer, na_http
+from schtob.pyontapi import py_gen, retry, system
+
+# Errors which mean that the filer has closed a connection.
+CONNECTION_ERRORS = (OSError, na_http.HTTPException,
+                     asyncio.IncompleteReadError)
+
+# Settings of NaFiler which AsyncNaFiler does not support; setting them
+# raises ValueError.
+UNSUPPORTED_SETTINGS = ('coalesce_requests', 'lazy_api', 'prefetch_pages')
+
+
+class AsyncConnection(object):
+    """HTTP/1.1 keep-alive connection using asyncio streams."""
+
+    def __init__(self, host, port, ssl_context=None):
+        self.host = host
+        self.port = port
+        self._ssl_context = ssl_context
+        self._reader = None
+        self._writer = None
+        self._chunked = False
+        self._length = None
+
+    @property
+    def connected(self):
+        """`True` if the connection is open."""
+        return self._writer is not None
+
+    async def connect(self):
+        """Connect to the host and port specified in __init__."""
+        self._reader, self._writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self._ssl_context)
+
+    def is_alive(self):
+        """Check if an idle connection is still usable."""
+        if self._writer is None:
+            return True
+        return not self._reader.at_eof() and \
+            not self._writer.transport.is_closing()
+
+    def close(self):
+        """Close the connection."""
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+
+    def verify_certificate(self):
+        """Verify server certificate."""
+        cert = self._writer.get_extra_info('peercert') or {}
+        for val in cert.get('subject', ()):
+            if val[0][0].lower() == 'commonname':
+                return val[0][1].lower() == self.host.lower()
+        return False
+
+    async def request(self, url, headers, content):
+        """POST `content` to `url` and read the response headers. Returns a
+        tuple of ``(status, will_close)``; the body has to be read with
+        :meth:`read_body` afterwards.
+        """
+        lines = ['POST %s HTTP/1.1' % url,
+                 'Host: %s:%s' % (self.host, self.port),
+                 'Accept-Encoding: identity']
+        lines.extend(['%s: %s' % header for header in headers])
+        self._writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin1'))
+        self._writer.write(content)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise na_http.HTTPException('Remote end closed connection')
+        try:
+            version, status = status_line.decode('latin1').split(None, 2)[:2]
+            status = int(status)
+        except ValueError:
+            raise na_http.HTTPException('Bad status line %r' % status_line)
+
+        response_headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b'\n'):
+                break
+            if not line:
+                raise na_http.HTTPException('Remote end closed connection')
+            name, _, value = line.decode('latin1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        connection = response_headers.get('connection', '').lower()
+        will_close = connection == 'close' or \
+            (version == 'HTTP/1.0' and connection != 'keep-alive')
+
+        self._chunked = response_headers.get(
+            'transfer-encoding', '').lower() == 'chunked'
+        self._length = None
+        if not self._chunked and 'content-length' in response_headers:
+            self._length = int(response_headers['content-length'])
+        elif not self._chunked:
+            will_close = True
+        return status, will_close
+
+    async def read_body(self, feed):
+        """Read the response body and pass it to `feed` chunk by chunk as
+        it arrives.
+        """
+        if self._chunked:
+            await self._read_chunked(feed)
+        elif self._length is not None:
+            await self._read_length(self._length, feed)
+        else:
+            while True:
+                data = await self._reader.read(na_filer.RESPONSE_CHUNK_SIZE)
+                if not data:
+                    break
+                feed(data)
+
+    async def _read_length(self, length, feed):
+        """Read `length` bytes of the body."""
+        while length > 0:
+            data = await self._reader.read(
+                min(length, na_filer.RESPONSE_CHUNK_SIZE))
+            if not data:
+                raise asyncio.IncompleteReadError(b'', length)
+            length -= len(data)
+            feed(data)
+
+    async def _read_chunked(self, feed):
+        """Read a body using chunked transfer encoding."""
+        while True:
+            line = await self._reader.readline()
+            size = int(line.split(b';', 1)[0].strip(), 16)
+            if not size:
+                break
+            await self._read_length(size, feed)
+            await self._reader.readexactly(2)
+        # skip trailers
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+
+
+class AsyncConnectionPool(object):
+    """Pool of :class:`AsyncConnection` instances to a single filer.
+
+    Works like :class:`schtob.pyontapi.na_http.ConnectionPool`, but waits for
+    a free connection without blocking the event loop.
+    """
+
+    def __init__(self, factory, size=4, idle_timeout=30.0):
+        self._factory = factory
+        self._size = size
+        self._idle_timeout = idle_timeout
+        self._idle = []
+        self._semaphore = None
+        if size:
+            self._semaphore = asyncio.Semaphore(size)
+
+    async def get(self):
+        """Check out a connection."""
+        if self._semaphore is not None:
+            await self._semaphore.acquire()
+        self._evict_idle()
+        while self._idle:
+            connection = self._idle.pop()[0]
+            if connection.is_alive():
+                return connection
+            connection.close()
+        try:
+            return self._factory()
+        except:
+            self._release()
+            raise
+
+    def put(self, connection):
+        """Give `connection` back to the pool."""
+        if self._semaphore is None:
+            connection.close()
+            return
+        self._idle.append((connection, time.time()))
+        self._release()
+
+    def discard(self, connection):
+        """Close `connection` and free its slot in the pool."""
+        connection.close()
+        self._release()
+
+    def clear(self):
+        """Close all idle connections."""
+        while self._idle:
+            self._idle.pop()[0].close()
+
+    def _release(self):
+        """Free a slot."""
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def _evict_idle(self):
+        """Close connections which were idle for more than `idle_timeout`."""
+        if self._idle_timeout is None:
+            return
+        limit = time.time() - self._idle_timeout
+        while self._idle and self._idle[0][1] < limit:
+            self._idle.pop(0)[0].close()
+
+
+class AsyncBaseAPI(api.BaseAPI):
+    """Base class for all asynchronous ONTAPI classes.
+
+    All generated API commands return awaitables. Generators for iterator
+    style commands are not added.
+    """
+
+    paginate = False
+
+    async def invoke_command(self, command, **kwargs):
+        """Invoke `command` on filer using `kwargs` as arguments."""
+        return await api.BaseAPI.invoke_command(self, command, **kwargs)
+
+
+class AsyncNaFiler(na_filer.NaFiler):
+    """asyncio counterpart of :class:`schtob.pyontapi.NaFiler`.
+
+    Takes the same `settings`, except for **coalesce_requests**,
+    **lazy_api** and **prefetch_pages** (see :data:`UNSUPPORTED_SETTINGS`),
+    which raise :exc:`ValueError`. As there are no generators for iterator
+    style commands, **page_size** and **prefetch_max_records** have no
+    effect. Creating an instance does no I/O; the API classes are added by
+    :meth:`connect`. Use :meth:`create` to do both.
+
+    **read_timeout** limits the wait for the response headers and for the
+    body each. Deadlines work like in :class:`schtob.pyontapi.NaFiler`.
+    """
+
+    api_class = AsyncBaseAPI
+
+    def _setup(self, settings):
+        for name in UNSUPPORTED_SETTINGS:
+            if self._settings[name]:
+                raise ValueError('%s is not supported by AsyncNaFiler' %
+                                 name)
+        self._user_settings = settings
+        self._pool = None
+
+    @classmethod
+    async def create(cls, filer, settings=None):
+        """Create a new connection to filer `filer` and generate the API
+        classes.
+        """
+        instance = cls(filer, settings)
+        await instance.connect()
+        return instance
+
+    async def connect(self):
+        """Negotiate the transport and add the API classes."""
+        if self._test_https_required(self._user_settings):
+            await self.__test_https()
+        self._handle_servertype()
+        self._pool = AsyncConnectionPool(
+            self.__get_connection, self._settings['pool_size'],
+            self._settings['pool_idle_timeout'])
+        if self._settings['raw_api'] and self._user_settings and \
+                'ontapi_version' in self._user_settings:
+            return
+
+        try:
+            result = await system.System(self).get_ontapi_version()
+        except errors.APIFailure as exc:
+            raise self._ontapi_version_error(exc)
+
+        self._set_ontapi_version(result)
+        if self._settings['raw_api']:
+            return
+        api_classes = self._load_bindings()
+        if api_classes is not None:
+            self._set_api_classes(api_classes)
+        else:
+            self._set_api_catalog(await get_catalog(self))
+
+    async def call(self, api_command_name, **kwargs):
+        """Invoke `api_command_name` using `kwargs` as arguments."""
+        return await na_filer.NaFiler.call(self, api_command_name, **kwargs)
+
+    async def raw_call(self, api_command_name, **kwargs):
+        """Invoke `api_command_name` without using the API schema."""
+        return await na_filer.NaFiler.raw_call(self, api_command_name,
+                                               **kwargs)
+
+    async def do_api_call(self, api_command_name, arguments, fields,
+                          deadline=None):
+        """Create new API call for `api_command_name` using `arguments` and
+        return the result as a dictionary using `fields` to parse the
+        response.
+        """
+        return await self.do_api_request(
+            api_command_name, self._serialize(api_command_name, arguments),
+            fields, deadline)
+
+    async def do_api_request(self, api_command_name, request, fields,
+                             deadline=None):
+        """Send the serialized `request` element for `api_command_name` and
+        return the result as a dictionary using `fields` to parse the
+        response. Uses :attr:`result_cache` like
+        :meth:`schtob.pyontapi.NaFiler.do_api_request`. No connect or read
+        waits beyond `deadline` seconds, if given.
+        """
+        expires = api.get_expires(deadline)
+        cache = self.result_cache
+        if cache is None:
+            return (await self.__transmit(api_command_name, request, fields,
+                                          expires))[0]
+        ttl = cache.get_ttl(api_command_name)
+        if ttl is None:
+            result = (await self.__transmit(api_command_name, request,
+                                            fields, expires))[0]
+            cache.invalidate(api_command_name)
+            return result
+        if not ttl or not isinstance(fields, api.ResponseDecoder):
+            return (await self.__transmit(api_command_name, request, fields,
+                                          expires))[0]
+
+        key = (api_command_name, self._settings['vfiler'], request, fields)
+        hit, value = cache.lookup(api_command_name, key)
+        if hit:
+            return value
+        result, size = await self.__transmit(api_command_name, request,
+                                             fields, expires)
+        cache.store(api_command_name, key, result, size, value)
+        return result
+
+    async def __transmit(self, api_command_name, request, fields, expires):
+        """Send the request for `api_command_name` like :meth:`__send`,
+        passing the circuit breaker and retrying transient failures like
+        :class:`schtob.pyontapi.NaFiler`.
+        """
+        breaker = self.circuit_breaker
+        policy = self.retry_policy
+        if breaker is None and policy is None:
+            return await self.__send(request, fields, expires)
+
+        attempt = 0
+        while True:
+            if breaker is not None:
+                breaker.allow(self._filer)
+            try:
+                value = await self.__send(request, fields, expires)
+            except errors.APIFailure as exc:
+                if breaker is not None:
+                    breaker.record(retry.is_outage(exc))
+                delay = None
+                if policy is not None:
+                    delay = policy.get_delay(api_command_name, exc, attempt,
+                                             expires)
+                if delay is None:
+                    raise
+                self._log.debug('Retrying %s on filer <%s> in %.2f seconds: '
+                                '%s', api_command_name, self._filer, delay,
+                                exc.reason)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except:
+                if breaker is not None:
+                    breaker.record(None)
+                raise
+            if breaker is not None:
+                breaker.record(False)
+            return value
+
+    async def __send(self, request, fields, expires=None):
+        """Send the serialized `request` element and return the result
+        parsed using `fields` and the size of the response. The call ends
+        at the point in time `expires`, if given.
+        """
+        content = self._build_request(request)
+        parser = self._get_parser(fields)
+        await self.__request(content, parser.feed, expires)
+        return parser.close(), parser.size
+
+    async def __request(self, content, feed, expires=None):
+        """POST `content` to the filer and pass the response body to `feed`
+        chunk by chunk as it arrives. No wait lasts beyond the point in time
+        `expires`.
+        """
+        connection, reused = await self.__checkout_connection(expires)
+        headers = self._get_headers(content)
+        try:
+            response = await _wait(
+                connection.request(self._settings['url'], headers, content),
+                self._get_timeout('read_timeout', expires))
+        except asyncio.TimeoutError:
+            # the filer may still process the request, do not send it again
+            self._pool.discard(connection)
+            raise self.__get_timeout_error(expires)
+        except CONNECTION_ERRORS as exc:
+            self._pool.discard(connection)
+            if not reused:
+                raise self.__get_connection_error(exc, expires)
+            self._log.debug('Connection to filer <%s> was closed, '
+                            'reconnecting', self._filer)
+            self._pool.clear()
+            connection = (await self.__checkout_connection(expires))[0]
+            try:
+                response = await _wait(
+                    connection.request(self._settings['url'], headers,
+                                       content),
+                    self._get_timeout('read_timeout', expires))
+            except asyncio.TimeoutError:
+                self._pool.discard(connection)
+                raise self.__get_timeout_error(expires)
+            except CONNECTION_ERRORS as exc:
+                self._pool.discard(connection)
+                raise self.__get_connection_error(exc, expires)
+            except:
+                self._pool.discard(connection)
+                raise
+        except:
+            self._pool.discard(connection)
+            raise
+
+        status, will_close = response
+        if status != 200:
+            # the body is not parsed, but needs to be read to reuse the
+            # connection
+            feed = _ignore
+        try:
+            await _wait(connection.read_body(feed),
+                        self._get_timeout('read_timeout', expires, True))
+        except asyncio.TimeoutError:
+            self._pool.discard(connection)
+            raise self.__get_timeout_error(expires)
+        except CONNECTION_ERRORS as exc:
+            self._pool.discard(connection)
+            raise self.__get_connection_error(exc, expires)
+        except:
+            self._pool.discard(connection)
+            raise
+
+        if will_close:
+            self._pool.discard(connection)
+        else:
+            self._pool.put(connection)
+
+        self._check_status(status)
+
+    async def __checkout_connection(self, expires=None):
+        """Get a connected connection out of the pool and whether it was
+        connected before. Waits until the point in time `expires` at most.
+        """
+        try:
+            connection = await _wait(self._pool.get(),
+                                     api.get_remaining(expires))
+        except asyncio.TimeoutError:
+            raise self._get_deadline_error()
+        if connection.connected:
+            return connection, True
+
+        try:
+            await _wait(connection.connect(),
+                        self._get_timeout('connect_timeout', expires))
+        except asyncio.TimeoutError:
+            self._pool.discard(connection)
+            raise self.__get_timeout_error(expires)
+        except ssl.SSLError:
+            self._pool.discard(connection)
+            if self._settings['style'] == constants.CERTIFICATE:
+                raise
+            self._fall_back_to_http()
+            return await self.__checkout_connection(expires)
+        except OSError as exc:
+            self._pool.discard(connection)
+            raise self.__get_connection_error(exc, expires)
+        except:
+            self._pool.discard(connection)
+            raise
+
+        if self._settings['style'] == constants.CERTIFICATE and \
+                self._settings['verify_cn']:
+            if not connection.verify_certificate():
+                self._pool.discard(connection)
+                raise errors.CertificateError()
+        return connection, False
+
+    def __get_timeout_error(self, expires):
+        """Get the error for a connect or read timeout, which is a deadline
+        error if `expires` has passed.
+        """
+        if expires is not None and time.time() >= expires:
+            return self._get_deadline_error(True)
+        return _timeout_error()
+
+    def __get_connection_error(self, exc, expires):
+        """Get the error for the connection error `exc`, see
+        :meth:`__get_timeout_error`.
+        """
+        if expires is not None and time.time() >= expires:
+            return self._get_deadline_error(True)
+        return errors.ConnectionFailure(str(exc))
+
+    def __get_connection(self):
+        """Returns a new, not yet connected connection to the filer, using
+        the shared SSL context of its settings for HTTPS.
+        """
+        ssl_context = None
+        if self._settings['style'] == constants.CERTIFICATE:
+            ssl_context = na_http.get_ssl_context(
+                self._settings['key_file'], self._settings['cert_file'],
+                self._settings['ca_file'], self._settings['cert_required'])
+        elif self._settings['transport_type'] == constants.HTTPS:
+            ssl_context = na_http.get_ssl_context()
+        return AsyncConnection(self._filer, self._settings['port'],
+                               ssl_context)
+
+    async def __test_https(self):
+        """Test if a HTTPS connection is possible for this filer, using
+        :data:`schtob.pyontapi.na_http.transport_cache`.
+        """
+        ttl = self._settings['transport_cache_ttl']
+        path = self._get_transport_cache_path()
+        transport_type = None
+        if ttl:
+            transport_type = na_http.transport_cache.get(self._filer, path)
+        if transport_type is None:
+            transport_type = await self.__probe_https()
+            if ttl:
+                na_http.transport_cache.put(self._filer, transport_type, ttl,
+                                            path)
+        self._set_https_available(transport_type == constants.HTTPS)
+
+    async def __probe_https(self):
+        """Return the transport type depending on whether port 443 of the
+        filer accepts connections.
+        """
+        try:
+            writer = (await asyncio.wait_for(
+                asyncio.open_connection(self._filer, 443),
+                na_filer.HTTPS_TEST_TIMEOUT))[1]
+            writer.close()
+            return constants.HTTPS
+        except (OSError, asyncio.TimeoutError):
+            return constants.HTTP
+
+    def close(self):
+        """Close all idle connections to the filer."""
+        if self._pool is not None:
+            self._pool.clear()
+
+
+def _ignore(data):
+    """Discard `data`."""
+
+
+async def _wait(awaitable, timeout):
+    """Await `awaitable` for at most `timeout` seconds; `None` waits
+    forever.
+    """
+    if timeout is None:
+        return await awaitable
+    return await asyncio.wait_for(awaitable, timeout)
+
+
+def _timeout_error():
+    """Get the error for a connect or read timeout."""
+    return errors.ConnectionFailure('timed out')
+
+
+async def generate(filer):
+    """Awaitable counterpart of :func:`schtob.pyontapi.py_gen.generate`."""
+    return (await get_catalog(filer)).packages
+
+
+async def get_catalog(filer):
+    """Awaitable counterpart of :func:`schtob.pyontapi.py_gen.get_catalog`.
+
+    The API types and the chunks of API elements are fetched concurrently.
+    """
+    builder = py_gen.CatalogBuilder(filer)
+    catalog = builder.load()
+    if catalog is not None:
+        return catalog
+
+    package = system.System(filer)
+    if builder.needs_api_list:
+        try:
+            result = await package.api_list()
+        except errors.APIFailure as exc:
+            raise py_gen.api_list_error(exc)
+        builder.set_api_names(py_gen.get_command_names(result))
+
+    catalog = builder.find()
+    if catalog is None:
+        types, elements = await asyncio.gather(
+            get_api_types(package),
+            get_api_elements(package, builder.get_chunks(), builder.workers,
+                             builder.retries))
+        catalog = builder.share(py_gen.APICatalog(types, elements))
+    return builder.store(catalog)
+
+
+async def get_api_types(package):
+    """Invoke `system-api-list-types` and return the result."""
+    try:
+        return await package.get_api_list_types()
+    except errors.APIFailure as exc:
+        raise py_gen.api_types_error(exc)
+
+
+async def get_api_elements(package, chunks, max_workers, retries):
+    """Awaitable counterpart of
+    :func:`schtob.pyontapi.py_gen.fetch_api_elements`: invoke
+    `system-api-get-elements` for the command lists `chunks`, at most
+    `max_workers` at a time, and return the merged results.
+    """
+    results = [None] * len(chunks)
+    pending = list(range(len(chunks)))
+    failures = []
+
+    async def work():
+        while pending and not failures:
+            index = pending.pop(0)
+            try:
+                results[index] = await get_with_retries(
+                    package.api_get_elements, chunks[index], retries)
+            except errors.APIFailure as exc:
+                failures.append(exc)
+
+    await asyncio.gather(
+        *[work() for _ in range(max(1, min(max_workers, len(chunks))))])
+    if failures:
+        raise py_gen.api_elements_error(failures[0])
+    return py_gen.merge_api_elements(results)
+
+
+async def get_with_retries(get_elements, cmd_list, retries):
+    """Awaitable counterpart of
+    :func:`schtob.pyontapi.py_gen.get_with_retries`.
+    """
+    attempt = 0
+    while True:
+        try:
+            return await get_elements(cmd_list)
+        except errors.APIFailure as exc:
+            attempt += 1
+            delay = py_gen.get_retry_delay(cmd_list, exc, attempt, retries)
+            if delay is None:
+                raise
+        await asyncio.sleep(delay)
@@ -19,8 +19,24 @@
 """
 
 import copy
+import sys
+import threading
+import time
 
-from schtob.pyontapi.na_filer import NaFiler
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from schtob.pyontapi.errors import APITimeoutError
+from schtob.pyontapi.na_filer import CONNECT_TIMEOUT, READ_TIMEOUT, NaFiler
+
+# Default number of filers :meth:`Filers.map` talks to at the same time.
+MAP_MAX_WORKERS = 16
+
+# Lower limit in seconds of the timeouts of connections created by
+# :meth:`Filers.map` and :meth:`Filers.warm_up` near their deadline.
+MIN_TIMEOUT = 0.01
 
 
 class Filers(object):
@@ -29,11 +45,20 @@ class Filers(object):
     Use it in a static way like this::
 
         >>> Filers('my-filer').volume.list_info()
+
+    :class:`Filers` and the :class:`schtob.pyontapi.NaFiler` instances it
+    hands out may be shared by many threads. Each connection is created
+    only once; threads asking for it meanwhile wait for it. Every API call
+    uses its own connection out of the filer's connection pool (see
+    setting **pool_size**).
     """
 
     __filers = {}
     __config = {}
     __unset = True
+    # guards the dicts; one lock per (name, role) being created
+    __lock = threading.Lock()
+    __key_locks = {}
 
     def __new__(cls, name, role='default'):
         # you can access a connection by typing Filers(filername).foo
@@ -56,30 +81,77 @@ class Filers(object):
         .. versionadded:: 0.2.2
             The role parameter was added.
         """
-        if (name, role) not in cls.__filers:
-            if cls.__unset:
-                cls.__config = __import__(
-                    'schtob.pyontapi.settings', {}, {}, ['NA_CONFIG']
-                ).NA_CONFIG
-                cls.__unset = False
-            roles = copy.deepcopy(cls.__config['roles'])
-            filer_roles = cls.__config.get('filer-roles', {})
+        return cls.__get_connection(name, role)
 
-            rolesettings = roles['default']
+    get_connection = classmethod(get_connection)
 
-            if name in filer_roles and 'default' in filer_roles[name]:
-                rolesettings.update(filer_roles[name]['default'])
+    def __get_connection(cls, name, role, expires=None):
+        """Get connection to filer `name` for `role`. If it is created, it
+        connects and waits for answers no longer than until the point in
+        time `expires`.
+        """
+        key = (name, role)
+        try:
+            return cls.__filers[key]
+        except KeyError:
+            pass
+
+        cls.__lock.acquire()
+        try:
+            key_lock = cls.__key_locks.setdefault(key, threading.Lock())
+        finally:
+            cls.__lock.release()
+        key_lock.acquire()
+        try:
+            if key in cls.__filers:
+                return cls.__filers[key]
+            return cls.__create(name, role, expires)
+        finally:
+            key_lock.release()
 
-            if role in roles:
-                rolesettings.update(roles[role])
+    __get_connection = classmethod(__get_connection)
+
+    def __create(cls, name, role, expires=None):
+        """Create the connection to filer `name` for `role` out of the
+        configuration, see :meth:`__get_connection`.
+        """
+        if cls.__unset:
+            cls.__config = __import__(
+                'schtob.pyontapi.settings', {}, {}, ['NA_CONFIG']
+            ).NA_CONFIG
+            cls.__unset = False
+        roles = copy.deepcopy(cls.__config['roles'])
+        filer_roles = cls.__config.get('filer-roles', {})
 
-            if name in filer_roles and role in filer_roles[name]:
-                rolesettings.update(filer_roles[name][role])
+        rolesettings = roles['default']
 
+        if name in filer_roles and 'default' in filer_roles[name]:
+            rolesettings.update(filer_roles[name]['default'])
+
+        if role in roles:
+            rolesettings.update(roles[role])
+
+        if name in filer_roles and role in filer_roles[name]:
+            rolesettings.update(filer_roles[name][role])
+
+        if expires is None:
             return cls.create_connection(name, rolesettings, role)
-        return cls.__filers[(name, role)]
+        timeouts = {
+            'connect_timeout': rolesettings.get('connect_timeout',
+                                                CONNECT_TIMEOUT),
+            'read_timeout': rolesettings.get('read_timeout', READ_TIMEOUT),
+        }
+        limited = dict(rolesettings)
+        remaining = max(expires - time.time(), MIN_TIMEOUT)
+        for setting, timeout in timeouts.items():
+            if timeout is None or timeout > remaining:
+                limited[setting] = remaining
+        filer = cls.create_connection(name, limited, role)
+        # later calls are limited by their own deadline
+        filer._settings.update(timeouts)
+        return filer
 
-    get_connection = classmethod(get_connection)
+    __create = classmethod(__create)
 
     def create_connection(cls, name, settings, role='default'):
         """Create a connection to filer `name` with `settings`.
@@ -90,14 +162,152 @@ class Filers(object):
         .. versionadded:: 0.2.2
             The role parameter was added.
         """
-        cls.__filers[(name, role)] = NaFiler(name, settings)
-        return cls.__filers[(name, role)]
+        filer = cls.__filers[(name, role)] = NaFiler(name, settings)
+        return filer
 
     create_connection = classmethod(create_connection)
 
     def drop_connection(cls, name, role='default'):
-        """Drops connection to filer `name`."""
-        if (name, role) in cls.__filers:
-            cls.__filers.pop((name, role))
+        """Drops connection to filer `name` and closes its idle
+        connections.
+        """
+        filer = cls.__filers.pop((name, role), None)
+        if filer is not None:
+            filer.close()
+
+    drop_connection = classmethod(drop_connection)
+
+    def map(cls, command, names, role='default', timeout=None,
+            max_workers=MAP_MAX_WORKERS, **kwargs):
+        """Invoke API `command` using `kwargs` as arguments on each filer in
+        `names` concurrently, using at most `max_workers` threads.
+
+        Yields ``(name, result)`` pairs in completion order. `result` is the
+        raised exception if the call failed, or an
+        :class:`schtob.pyontapi.errors.APITimeoutError` if there was no
+        answer within `timeout` seconds after calling :meth:`map`. Calls
+        still queued then are not sent. The time left limits the
+        **connect_timeout** and **read_timeout** of connections created for
+        the calls and is passed to each call as its `deadline`, so a timed
+        out call ends soon after.
+
+        .. versionadded:: 0.4.0
+        """
+        def invoke(name, expires):
+            filer = cls.__get_connection(name, role, expires)
+            arguments = kwargs
+            if expires is not None:
+                deadline = max(expires - time.time(), 0)
+                if kwargs.get('deadline') is None or \
+                        kwargs['deadline'] > deadline:
+                    arguments = dict(kwargs, deadline=deadline)
+            return filer.call(command, **arguments)
+
+        return cls.__run(invoke, names, timeout, max_workers)
+
+    map = classmethod(map)
+
+    def warm_up(cls, names, roles=('default',), timeout=None,
+                max_workers=MAP_MAX_WORKERS):
+        """Create the connections to all filers in `names` for all `roles`
+        concurrently, using at most `max_workers` threads. Filers reporting
+        the same ONTAPI version share the API schema (see setting
+        **share_schema** of :class:`schtob.pyontapi.NaFiler`).
+
+        Returns a dict mapping ``(name, role)`` to a ``(seconds, error)``
+        tuple. `error` is `None` if the connection was created, the raised
+        exception otherwise or an
+        :class:`schtob.pyontapi.errors.APITimeoutError` if it was not
+        created within `timeout` seconds, see :meth:`map`.
+
+        .. versionadded:: 0.4.0
+        """
+        def connect(key, expires):
+            start = time.time()
+            try:
+                cls.__get_connection(key[0], key[1], expires)
+            except Exception:
+                return time.time() - start, sys.exc_info()[1]
+            return time.time() - start, None
+
+        keys = []
+        for name in names:
+            for role in roles:
+                if (name, role) not in keys:
+                    keys.append((name, role))
+
+        report = {}
+        for key, result in cls.__run(connect, keys, timeout, max_workers):
+            if isinstance(result, APITimeoutError):
+                result = (timeout, result)
+            report[key] = result
+        return report
+
+    warm_up = classmethod(warm_up)
+
+    def __run(cls, func, items, timeout, max_workers):
+        """Call `func` for each of `items` in at most `max_workers` threads
+        and yield ``(item, result)`` pairs in completion order, see
+        :meth:`map`. `func` gets the item and the point in time `timeout`
+        expires (`None` without timeout).
+
+        When `timeout` expires, the items which are still running or
+        queued are yielded with an
+        :class:`schtob.pyontapi.errors.APITimeoutError`; the results of
+        running calls are dropped and queued items are skipped.
+        """
+        items = list(items)
+        expires = None
+        if timeout is not None:
+            expires = time.time() + timeout
+        # items are told apart by index, names may repeat
+        tasks = queue.Queue()
+        for index, item in enumerate(items):
+            tasks.put((index, item))
+        results = queue.Queue()
+
+        def work():
+            while True:
+                try:
+                    index, item = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                if expires is not None and time.time() >= expires:
+                    # already reported as timed out
+                    continue
+                try:
+                    result = func(item, expires)
+                except Exception:
+                    result = sys.exc_info()[1]
+                results.put((index, item, result))
+
+        for _ in range(min(max_workers, len(items))):
+            thread = threading.Thread(target=work)
+            thread.daemon = True
+            thread.start()
+        done = set()
+        try:
+            while len(done) < len(items):
+                wait = None
+                if expires is not None:
+                    wait = max(0, expires - time.time())
+                try:
+                    index, item, result = results.get(timeout=wait)
+                except queue.Empty:
+                    break
+                done.add(index)
+                yield item, result
+            for index, item in enumerate(items):
+                if index not in done:
+                    yield item, APITimeoutError(
+                        -1, 'No answer for %s within %s seconds' %
+                        (item, timeout))
+        finally:
+            # let the workers stop if the caller stops early
+            while True:
+                try:
+                    tasks.get_nowait()
+                except queue.Empty:
+                    break
 
-    drop_connection = classmethod(drop_connection)
\ No newline at end of file
+    __run = classmethod(__run)
@@ -14,12 +14,15 @@
 
 import base64
 import logging
+import os
 import socket
 import ssl
 import sys
-import xml.dom.minidom
+import threading
+import time
 
-from schtob.pyontapi import api, constants, errors, na_http, py_gen, system
+from schtob.pyontapi import api, bindings, constants, errors, na_http, \
+    py_gen, result_cache, retry, system
 
 
 # Custom log level for pyontap logger. set to logging.DEBUG for debugging
@@ -27,50 +30,227 @@ from schtob.pyontapi import api, constants, errors, na_http, py_gen, system
 # visit http://docs.python.org/library/logging.html for more details.
 LOG_LEVEL = logging.NOTSET
 
+# Timeout in seconds for testing if the filer accepts HTTPS connections.
+HTTPS_TEST_TIMEOUT = 0.25
+
+# Default timeouts in seconds for connecting to the filer and for waiting
+# for data of a response; `None` waits forever.
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = None
+
+# Name of the file in **schema_cache_dir** keeping the negotiated
+# transports, see :meth:`NaFiler._get_transport_cache_path`.
+TRANSPORT_CACHE_FILE = 'transports.json'
+
+# Size of the chunks in which responses are read and parsed.
+RESPONSE_CHUNK_SIZE = 32 * 1024
+
+# decoder for the results of raw_call()
+RAW_DECODER = api.RawResponseDecoder()
+
 
 class NaFiler(object):
     """Create a new connection to filer `filer` using `settings` dict.
 
     `settings` may consist of the following entries:
 
-        ================== ========= ===================================
-        Key                Default   Possible values
-        ================== ========= ===================================
-        **user**           "root"    `str`
-        **password**       ""        `str`
-        **style**          `LOGIN`   `LOGIN`, `HOSTS`, `CERTIFICATE`
-        **vfiler**         ""        `str`
-        **server_type**    "Filer"   "Filer", "NetCache", "DFM", "Agent"
-        **transport_type** `HTTP`    `HTTP`, `HTTPS`
-        **port**           `None`    `int`
-        **url**            `None`    `str`
-        **cert_file**      ""        Path to Cert file
-        **key_file**       ""        Path to Key file
-        **ca_file**        ""        Path to Key file
-        **cert_required**  False     `bool`
-        **verify_cn**      False     `bool`
-        **cmd_list**       'None'    'list of api_commands'
-        ================== ========= ===================================
+        ========================= ========= ===================================
+        Key                       Default   Possible values
+        ========================= ========= ===================================
+        **user**                  "root"    `str`
+        **password**              ""        `str`
+        **style**                 `LOGIN`   `LOGIN`, `HOSTS`, `CERTIFICATE`
+        **vfiler**                ""        `str`
+        **server_type**           "Filer"   "Filer", "NetCache", "DFM", "Agent"
+        **transport_type**        `HTTP`    `HTTP`, `HTTPS`
+        **port**                  `None`    `int`
+        **url**                   `None`    `str`
+        **cert_file**             ""        Path to Cert file
+        **key_file**              ""        Path to Key file
+        **ca_file**               ""        Path to Key file
+        **cert_required**         False     `bool`
+        **verify_cn**             False     `bool`
+        **connect_timeout**       10.0      `float`, seconds
+        **read_timeout**          `None`    `float`, seconds
+        **cmd_list**              'None'    'list of api_commands',
+                                            packages or patterns
+        **pool_size**             4         `int`, 0 disables keep-alive
+        **pool_idle_timeout**     30.0      `float`, seconds
+        **schema_cache_dir**      `None`    Path to schema cache directory
+        **schema_cache_size**     64 MiB    `int`, bytes
+        **share_schema**          True      `bool`
+        **transport_cache_ttl**   3600.0    `float`, seconds, 0 disables
+        **elements_chunk_size**   500       `int`, 0 disables chunking
+        **elements_workers**      4         `int`
+        **elements_retries**      2         `int`
+        **lazy_api**              False     `bool`, not for AsyncNaFiler
+        **raw_api**               False     `bool`
+        **bindings**              `None`    Python package name
+        **result_cache_size**     0         `int`, bytes, 0 disables cache
+        **result_cache_ttl**      30.0      `float`, seconds
+        **result_cache_ttls**     `None`    `dict`, command or pattern: TTL
+        **coalesce_requests**     False     `bool`, not for AsyncNaFiler
+        **retries**               0         `int`, 0 disables retries
+        **retry_delay**           0.5       `float`, seconds
+        **retry_max_delay**       10.0      `float`, seconds
+        **circuit_threshold**     0         `int`, 0 disables the breaker
+        **circuit_timeout**       30.0      `float`, seconds
+        **page_size**             100       `int`, records per page
+        **prefetch_pages**        0         `int`, not for AsyncNaFiler
+        **prefetch_max_records**  10000     `int`
+        ========================= ========= ===================================
+
+    API calls are sent over a pool of persistent HTTP/1.1 connections. At
+    most **pool_size** connections are opened at the same time; connections
+    which were idle for more than **pool_idle_timeout** seconds are closed.
+
+    Connecting to the filer, including the SSL handshake, may take up to
+    **connect_timeout** seconds; a response may pause for up to
+    **read_timeout** seconds. Each API command and :meth:`call` accept a
+    `deadline` keyword: the seconds the call may take in total, including
+    waiting for a pooled connection and reconnecting. The generators of
+    iterator style commands apply it to all pages. A call exceeding its
+    deadline raises :class:`schtob.pyontapi.errors.DeadlineExceededError`.
+
+    If **schema_cache_dir** is set, the API types and elements used to
+    generate the API classes are cached in this directory. A cache entry is
+    used as long as the filer reports the same ONTAPI version.
+
+    **cmd_list** restricts the API commands to generate. Besides command
+    names it may contain package names (``volume``) and glob patterns
+    (``volume-*``, ``snapmirror-get-*``) which are resolved against
+    `system-api-list`. Only the API types used by these commands are kept.
+
+    The API elements are requested with one `system-api-get-elements` call
+    per **elements_chunk_size** commands. Up to **elements_workers** of
+    these calls are sent concurrently, each is retried up to
+    **elements_retries** times.
+
+    If **transport_type** is not given or HTTPS, port 443 of the filer is
+    probed to decide between HTTPS and HTTP. The result, or HTTP after a
+    failed SSL handshake, is kept per host for **transport_cache_ttl**
+    seconds, so other instances for the same host skip the probe; with
+    **schema_cache_dir** it is kept on disk as well.
+
+    If **share_schema** is set, filers with the same server type, ONTAPI
+    version, **cmd_list** and list of API commands share one catalog of API
+    commands and API classes in memory; the API types and elements are only
+    requested from the first of them.
+
+    If **lazy_api** is set, only the ONTAPI version is requested on
+    construction. API classes are created on first access of
+    ``filer.<package>`` and API commands on first use, using a
+    `system-api-get-elements` call for just that command.
+
+    With **raw_api**, no API classes are generated at all: :meth:`call`
+    sends the request without knowing the API schema, see
+    :meth:`raw_call`. If **ontapi_version** is given as well, creating the
+    filer does not call the filer either.
+
+    If **bindings** is set to the name of a Python package holding binding
+    modules written by ``bin/pyontapi_generate_bindings.py``, the API
+    classes are taken out of the module for the filer's server type and
+    ONTAPI version; only the ONTAPI version is requested. Without a
+    matching module, the API classes are generated as usual.
+
+    If **result_cache_size** is set, the results of read-only API commands
+    (commands with `get`, `list`, `info`, `status` or `show` in their name)
+    are cached for **result_cache_ttl** seconds, keyed by command,
+    arguments and vfiler. **result_cache_ttls** sets the time to live per
+    API command name or glob pattern; 0 disables caching. A successful
+    command of any other kind drops the cached results of its package. The
+    least recently used results are dropped if the responses exceed
+    **result_cache_size** bytes. Hits and misses are counted by
+    :attr:`result_cache`, see
+    :class:`schtob.pyontapi.result_cache.ResultCache`.
+
+    If **coalesce_requests** is set, a read-only API command called while
+    the same call (command, arguments and vfiler) is already in flight in
+    another thread waits for that call and shares its result or exception.
+
+    If **retries** is set, read-only API commands failing with a transient
+    error (connection failures, HTTP status 421 or 503 and "try again"
+    error numbers, see :mod:`schtob.pyontapi.retry`) are repeated up to
+    that many times. Retry `n` waits a random time of up to
+    ``retry_delay * 2 ** n`` seconds, at most **retry_max_delay**.
+
+    If **circuit_threshold** is set, that many calls in a row failing
+    because the filer seems down (connection failures, HTTP status 5xx and
+    421, deadlines passing while connecting or waiting for the answer)
+    open a circuit breaker shared by the instances for the host: for
+    **circuit_timeout** seconds calls raise
+    :class:`schtob.pyontapi.errors.CircuitOpenError` without being sent,
+    then a single call probes the filer again.
+
+    A :class:`NaFiler` may be shared by many threads. Each API call uses
+    its own connection out of the pool and its own request and response
+    state; lazy generation of API classes and commands and the fall back
+    to HTTP after a failed SSL handshake happen once, under a lock.
+
+    Iterator style API commands get a generator which yields the records
+    page by page: ``filer.volume.iter_get()`` for `volume-get-iter` and
+    ``filer.file.iter_list_directory()`` for
+    `file-list-directory-iter-start/next/end`. **page_size** records are
+    requested per call. If **prefetch_pages** is set, up to that many pages
+    (but no more than **prefetch_max_records** records) are fetched ahead
+    in a background thread over another pooled connection while the caller
+    processes the current page.
 
     """
 
+    # class used for the API packages of this filer
+    api_class = api.BaseAPI
+
     def __init__(self, filer, settings=None):
         self._filer = filer
         self._log = logging.getLogger('pyontapi')
         self._api_modules = {}
+        self._command_index = None
+        self._typedefs = None
+        self._envelope = None
+        # generated command functions by API command name, see call()
+        self._call_targets = {}
+        # guards lazy generation and the transport fallback
+        self._lock = threading.RLock()
 
         self._log.setLevel(LOG_LEVEL)
 
         self._settings = {
+            'bindings': None,
             'cert_file': '',
             'cert_required': False,
+            'circuit_threshold': 0,
+            'circuit_timeout': retry.CIRCUIT_TIMEOUT,
+            'coalesce_requests': False,
+            'connect_timeout': CONNECT_TIMEOUT,
+            'elements_chunk_size': py_gen.ELEMENTS_CHUNK_SIZE,
+            'elements_retries': py_gen.ELEMENTS_RETRIES,
+            'elements_workers': py_gen.ELEMENTS_WORKERS,
             'key_file': '',
             'ca_file': '',
+            'lazy_api': False,
             'ontapi_version': '1.0',
+            'page_size': 100,
             'password': '',
+            'pool_idle_timeout': 30.0,
+            'pool_size': 4,
             'port': None,
+            'prefetch_max_records': 10000,
+            'prefetch_pages': 0,
+            'raw_api': False,
+            'read_timeout': READ_TIMEOUT,
+            'result_cache_size': 0,
+            'result_cache_ttl': result_cache.RESULT_CACHE_TTL,
+            'result_cache_ttls': None,
+            'retries': 0,
+            'retry_delay': retry.RETRY_DELAY,
+            'retry_max_delay': retry.RETRY_MAX_DELAY,
+            'schema_cache_dir': None,
+            'schema_cache_size': py_gen.SCHEMA_CACHE_SIZE,
             'server_type': 'Filer',
+            'share_schema': True,
             'style': constants.LOGIN,
+            'transport_cache_ttl': na_http.TRANSPORT_CACHE_TTL,
             'transport_type': constants.HTTP,
             'url': None,
             'user': 'root',
@@ -82,13 +262,28 @@ class NaFiler(object):
             self.__test_settings(settings)
             self._settings.update(settings)
 
-        if settings and isinstance(settings, dict):
-            if 'transport_type' not in settings or \
-               settings['transport_type'] == constants.HTTPS:
-                # automatically try to use HTTPS if argument not specified or
-                # if transport_type is set to HTTPS
-                self.__test_https()
-        self.__handle_servertype()
+        # see do_api_request()
+        self.result_cache = result_cache.ResultCache.from_settings(
+            self._settings)
+        self.requests_in_flight = None
+        if self._settings['coalesce_requests']:
+            self.requests_in_flight = result_cache.RequestCoalescer()
+        self.retry_policy = retry.RetryPolicy.from_settings(self._settings)
+        self.circuit_breaker = retry.circuit_breaker_from_settings(
+            filer, self._settings)
+        self._setup(settings)
+
+    def _setup(self, settings):
+        """Negotiate the transport and add the API classes."""
+        if self._test_https_required(settings):
+            self.__test_https()
+        self._handle_servertype()
+        self._pool = na_http.ConnectionPool(
+            self.__get_connection, self._settings['pool_size'],
+            self._settings['pool_idle_timeout'])
+        if self._settings['raw_api'] and settings and \
+                'ontapi_version' in settings:
+            return
         self.__set_api_classes()
 
     def __set_api_classes(self):
@@ -97,119 +292,348 @@ class NaFiler(object):
         try:
             result = self.__get_ontapi_version()
         except errors.APIFailure:
-            exc = sys.exc_info()[1]
-            self._log.error("Can't get ontapi version. error was: %s",
-                            exc.get_error())
-            raise errors.UnknownOntapiVersionError(
-                exc.errno, "Can't get ontapi version. error was:\n%s" %
-                exc.reason)
-
+            raise self._ontapi_version_error(sys.exc_info()[1])
+
+        self._set_ontapi_version(result)
+        if self._settings['raw_api']:
+            return
+        api_classes = self._load_bindings()
+        if api_classes is not None:
+            self._set_api_classes(api_classes)
+        elif not self._settings['lazy_api']:
+            self._set_api_catalog(py_gen.get_catalog(self))
+
+    def _set_ontapi_version(self, result):
+        """Set the ONTAPI version out of a `system-get-ontapi-version`
+        `result`.
+        """
         self._settings['ontapi_version'] = \
             '%(major-version)s.%(minor-version)s' % result
 
-        api_modules = py_gen.generate(self)
+    def _ontapi_version_error(self, exc):
+        """Log and return an error for a failed version call."""
+        self._log.error("Can't get ontapi version. error was: %s",
+                        exc.get_error())
+        return errors.UnknownOntapiVersionError(
+            exc.errno, "Can't get ontapi version. error was:\n%s" %
+            exc.reason)
+
+    def _load_bindings(self):
+        """Get the API classes out of the binding module of setting
+        **bindings** for this filer, or `None` if there is none.
+        """
+        if not self._settings['bindings']:
+            return None
+        module = bindings.load(self._settings['bindings'],
+                               self._settings['server_type'],
+                               self._settings['ontapi_version'])
+        if module is None:
+            return None
+        return bindings.get_api_classes(module, self.api_class)
+
+    def _set_api_catalog(self, catalog):
+        """Add an instance of the API class of each package in the
+        :class:`schtob.pyontapi.py_gen.APICatalog` `catalog`.
+        """
+        api_classes = {}
+        for key in catalog.packages:
+            api_classes[key] = catalog.get_api_class(self.api_class, key)
+        self._set_api_classes(api_classes)
+
+    def _set_api_classes(self, api_classes):
+        """Add an instance of each class in `api_classes`, a dict mapping
+        package names to subclasses of :class:`schtob.pyontapi.api.BaseAPI`.
+        """
+        self._call_targets = {}
+        for key, api_class in api_classes.items():
+            self._api_modules[key] = api_class(self)
+            setattr(self, key, self._api_modules[key])
+
+    def _set_api_modules(self, api_modules):
+        """Add an instance of :attr:`api_class` for each package in
+        `api_modules`.
+        """
+        self._call_targets = {}
         for key, value in api_modules.items():
-            self._api_modules[key] = api.BaseAPI(self, value)
+            self._api_modules[key] = self.api_class(self, value)
             setattr(self, key, self._api_modules[key])
 
+    def __getattr__(self, name):
+        # only called if there is no such attribute: in lazy mode, API
+        # classes are created on first access
+        if name.startswith('_') or \
+                not self.__dict__.get('_settings', {}).get('lazy_api'):
+            raise AttributeError(name)
+        api_module = self.get_api_module(name)
+        if api_module is None:
+            raise AttributeError(name)
+        return api_module
+
+    def _get_command_index(self):
+        """Get a dict of `package_name`: `list of command names` for lazy
+        mode. Uses `cmd_list` if given, otherwise `system-api-list`. The
+        latter is needed as well to resolve patterns in `cmd_list`.
+        """
+        self._lock.acquire()
+        try:
+            if self._command_index is None:
+                self._command_index = self.__build_command_index()
+        finally:
+            self._lock.release()
+        return self._command_index
+
+    def __build_command_index(self):
+        """Build the dict for :meth:`_get_command_index`."""
+        cmd_list = self._settings.get('cmd_list')
+        if not cmd_list or py_gen.has_patterns(cmd_list):
+            try:
+                result = system.System(self).api_list()
+            except errors.APIFailure:
+                raise py_gen.api_list_error(sys.exc_info()[1])
+            cmd_list = py_gen.resolve_cmd_list(
+                cmd_list, py_gen.get_command_names(result))
+        index = {}
+        for name in cmd_list:
+            index.setdefault(name.split('-')[0], []).append(name)
+        return index
+
+    def _generate_commands(self, cmd_list):
+        """Generate :class:`api.APICommand` instances for all commands in
+        `cmd_list` (lazy mode).
+        """
+        package = system.System(self)
+        self._lock.acquire()
+        try:
+            if self._typedefs is None:
+                self._typedefs = py_gen.gen_typedefs(package)
+        finally:
+            self._lock.release()
+        packages = py_gen.get_api_command_packages(package, self._typedefs,
+                                                   cmd_list=cmd_list)
+        commands = []
+        for value in packages.values():
+            commands.extend(value)
+        return commands
+
     @property
     def settings(self):
         return self._settings
 
+    @property
+    def host(self):
+        """Host name of the filer."""
+        return self._filer
+
+    def close(self):
+        """Close all idle connections to the filer.
+
+        .. versionadded:: 0.4.0
+        """
+        self._pool.clear()
+
     def get_api_modules(self):
         """Get all API classes as a dictionary of `package_name`: `api_class`.
         """
+        if self._settings['lazy_api']:
+            for package_name in self._get_command_index():
+                self.get_api_module(package_name)
         return self._api_modules
 
     def get_api_module(self, package_name):
         """Get API class for `package_name`."""
+        if package_name not in self._api_modules and \
+                self._settings['lazy_api']:
+            self._lock.acquire()
+            try:
+                if package_name not in self._api_modules:
+                    self.__add_lazy_module(package_name)
+            finally:
+                self._lock.release()
         return self._api_modules.get(package_name, None)
 
+    def __add_lazy_module(self, package_name):
+        """Add the API class for `package_name` in lazy mode."""
+        command_names = self._get_command_index().get(package_name)
+        if command_names:
+            api_module = self.api_class(self, command_names=command_names)
+            self._api_modules[package_name] = api_module
+            setattr(self, package_name, api_module)
+
     def call(self, api_command_name, **kwargs):
-        """Invoke `api_command_name` using `kwargs` as arguments.
+        """Invoke `api_command_name` using `kwargs` as arguments. The call
+        must finish within `deadline` seconds if this keyword is given.
 
         .. versionadded:: 0.2.5
         """
-        bits = api_command_name.split('-')
-        package_name = bits[0]
-        command_name = '-'.join(bits[1:])
         try:
-            api_module = self._api_modules[package_name]
+            target = self._call_targets[api_command_name]
         except KeyError:
-            raise errors.UnknownCommandError(-1, 'No such api command %s' %
-                                             api_command_name)
-        return api_module.invoke_command(command_name, **kwargs)
+            target = self._get_call_target(api_command_name)
+        return target(**kwargs)
 
-    def do_api_call(self, api_command_name, arguments, fields):
-        """Create new API call for `api_command_name` using `arguments` and
-        return the result as a dictionary using `fields` to parse the
-        response.
+    def _get_call_target(self, api_command_name):
+        """Resolve the generated function for `api_command_name` and cache
+        it for :meth:`call`.
         """
-        xmlcontent = self.__get_xml_content(api_command_name, arguments)
-        self._log.debug('XML request: %s', xmlcontent.toprettyxml())
-
-        content = xmlcontent.toxml(encoding='utf-8')
-
-        def prepare_connection():
-            """Prepare connection to the filer."""
-            con = self.__get_connection()
-            con.putrequest('POST', self._settings['url'])
-            con.putheader('Content-Length', len(content))
-            con.putheader('Content-type', 'text/xml; charset="UTF-8"')
-
-            if self._settings['style'] == constants.LOGIN:
-                login = '%(user)s:%(password)s' % self._settings
-                if sys.version_info >= (3, 0):
-                    encoded = base64.encodestring(login.encode())
-                    encoded = encoded.decode().strip()
-                else:
-                    encoded = base64.encodestring(login)[:-1]
-                con.putheader('Authorization', 'Basic %s' % encoded)
-            elif self._settings['style'] == constants.CERTIFICATE and \
-                    self._settings['verify_cn']:
-                if not con.verify_certificate():
-                    raise errors.CertificateError()
-
-            return con
-
-        connection = prepare_connection()
-
+        if self._settings['raw_api']:
+            def target(**kwargs):
+                return self.raw_call(api_command_name, **kwargs)
+            self._call_targets[api_command_name] = target
+            return target
+        bits = api_command_name.split('-')
+        api_module = self.get_api_module(bits[0])
         try:
-            connection.endheaders()
-        except ssl.SSLError:
-            self._settings['transport_type'] = constants.HTTP
-            connection = prepare_connection()
-            connection.endheaders()
-
-        connection.send(content)
+            if api_module is None:
+                raise KeyError(api_command_name)
+            target = api_module.get_command('-'.join(bits[1:]))
+        except KeyError:
+            raise errors.UnknownCommandError(-1, 'No such api command %s' %
+                                             api_command_name)
+        self._call_targets[api_command_name] = target
+        return target
 
-        try:
-            response = connection.getresponse()
-        except Exception:
-            exc = sys.exc_info()[1]
-            raise errors.APIFailure(-1, str(exc))
+    def raw_call(self, api_command_name, **kwargs):
+        """Invoke `api_command_name` without using the API schema. The
+        arguments are written as given (see
+        :func:`schtob.pyontapi.api.serialize_raw`), the result is returned
+        as nested dictionaries and lists with text values (see
+        :class:`schtob.pyontapi.api.RawResponseDecoder`)::
 
-        if response.status != 200:
-            if response.status in na_http.RESPONSES:
-                raise errors.APIFailure(13002, 'HTTP result status %s' %
-                                        response.status)
-            else:
-                raise errors.APIFailure(13002, 'HTTP result status %s "%s"' %
-                                        (response.status,
-                                         na_http.RESPONSES[response.status]))
+            filer.raw_call('volume-get-iter', max_records=10,
+                           desired_attributes={'volume-attributes': {
+                               'volume-id-attributes': {'name': ''}}})
 
-        dom = xml.dom.minidom.parseString(
-            response.read().decode('latin1').encode('utf-8')
-        )
+        The keyword `deadline` is not sent, see :meth:`call`.
 
-        connection.close()
+        .. versionadded:: 0.4.0
+        """
+        deadline = api.pop_deadline(kwargs)
+        return self.do_api_request(
+            api_command_name, api.serialize_raw(api_command_name, kwargs),
+            RAW_DECODER, deadline)
 
-        self._log.debug('XML response: %s', dom.toprettyxml())
+    def do_api_call(self, api_command_name, arguments, fields,
+                    deadline=None):
+        """Create new API call for `api_command_name` using `arguments` and
+        return the result as a dictionary using `fields` to parse the
+        response.
 
-        return self.__parse_dom(dom, fields)
+        :param fields: list of :class:`schtob.pyontapi.api.NaField`
+                       instances or a compiled
+                       :class:`schtob.pyontapi.api.ResponseDecoder`.
+        """
+        return self.do_api_request(
+            api_command_name, self._serialize(api_command_name, arguments),
+            fields, deadline)
+
+    def do_api_request(self, api_command_name, request, fields,
+                       deadline=None):
+        """Send the serialized `request` element (see
+        :class:`schtob.pyontapi.api.RequestSerializer`) for
+        `api_command_name` and return the result as a dictionary using
+        `fields` to parse the response. The call must finish within
+        `deadline` seconds, if given.
+
+        Results of read-only commands are cached if **result_cache_size**
+        is set; `fields` must be a
+        :class:`schtob.pyontapi.api.ResponseDecoder` for that. Concurrent
+        identical read-only requests are coalesced if
+        **coalesce_requests** is set. Transient failures are retried if
+        **retries** is set, calls to a filer which is down are rejected if
+        **circuit_threshold** is set.
+
+        .. versionadded:: 0.4.0
+        """
+        expires = api.get_expires(deadline)
+        cache = self.result_cache
+        in_flight = self.requests_in_flight
+        if cache is None and in_flight is None:
+            return self.__transmit(api_command_name, request, fields,
+                                   expires)[0]
+
+        ttl = 0
+        if cache is not None:
+            ttl = cache.get_ttl(api_command_name)
+            if ttl is None:
+                result = self.__transmit(api_command_name, request, fields,
+                                         expires)[0]
+                cache.invalidate(api_command_name)
+                return result
+
+        key = (api_command_name, self._settings['vfiler'], request, fields)
+        if ttl and isinstance(fields, api.ResponseDecoder):
+            hit, value = cache.lookup(api_command_name, key)
+            if hit:
+                return value
+
+            def send():
+                result, size = self.__transmit(api_command_name, request,
+                                               fields, expires)
+                cache.store(api_command_name, key, result, size, value)
+                return result
+        else:
+            ttl = 0
+
+            def send():
+                return self.__transmit(api_command_name, request, fields,
+                                       expires)[0]
+
+        if in_flight is not None and \
+                (ttl or result_cache.is_coalescable(api_command_name)):
+            return in_flight.call(key, send, expires)
+        return send()
+
+    def __transmit(self, api_command_name, request, fields, expires):
+        """Send the request for `api_command_name` like :meth:`__send`,
+        passing the circuit breaker and retrying transient failures.
+        """
+        breaker = self.circuit_breaker
+        policy = self.retry_policy
+        if breaker is None and policy is None:
+            return self.__send(request, fields, expires)
+
+        attempt = 0
+        while True:
+            if breaker is not None:
+                breaker.allow(self._filer)
+            try:
+                value = self.__send(request, fields, expires)
+            except errors.APIFailure:
+                exc = sys.exc_info()[1]
+                if breaker is not None:
+                    breaker.record(retry.is_outage(exc))
+                delay = None
+                if policy is not None:
+                    delay = policy.get_delay(api_command_name, exc, attempt,
+                                             expires)
+                if delay is None:
+                    raise
+                self._log.debug('Retrying %s on filer <%s> in %.2f seconds: '
+                                '%s', api_command_name, self._filer, delay,
+                                exc.reason)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except:
+                if breaker is not None:
+                    breaker.record(None)
+                raise
+            if breaker is not None:
+                breaker.record(False)
+            return value
+
+    def __send(self, request, fields, expires=None):
+        """Send the serialized `request` element and return the result
+        parsed using `fields` and the size of the response. The call ends
+        at the point in time `expires`, if given.
+        """
+        content = self._build_request(request)
+        parser = self._get_parser(fields)
+        self.__request(content, parser.feed, expires)
+        return parser.close(), parser.size
 
-    def __get_xml_content(self, api_command_name, arguments):
-        """Create a XML query document for `api_command_name` and pass
+    def _serialize(self, api_command_name, arguments):
+        """Serialize the request element for `api_command_name` and
         `arguments`.
 
         :param arguments: A list of :class:`schtob.pyontapi.NaArgument`
@@ -217,56 +641,223 @@ class NaFiler(object):
                           and the information how to generate the corresponding
                           XML structure.
         """
-        doc = xml.dom.minidom.Document()
-        netapp = doc.createElement('netapp')
-
-        if self._settings['vfiler']:
-            netapp.setAttribute('vfiler', self._settings['vfiler'])
-        netapp.setAttribute('version', self._settings['ontapi_version'])
-        doc.appendChild(netapp)
-
-        api_element = doc.createElement(api_command_name)
-        netapp.appendChild(api_element)
+        serializer = api.RequestSerializer(api_command_name, arguments)
+        return serializer.serialize([arg.value for arg in arguments])
 
-        for arg in arguments:
-            arg.append_to_doc(doc, api_element)
-        return doc
-
-    def __parse_dom(self, dom, fields):
-        """Parse XML response `dom` using `fields`.
-
-        :param fields: list of :class:`schtob.pyontap.api.NaField` instances.
+    def _build_request(self, request):
+        """Wrap the `request` element into the ``<netapp>`` envelope and
+        return the XML request as UTF-8 encoded bytes.
         """
-        results = dom.getElementsByTagName("results")[0]
-
-        status = results.getAttribute('status')
+        key = (self._settings['vfiler'], self._settings['ontapi_version'])
+        # read once, other threads may replace it
+        envelope = self._envelope
+        if envelope is None or envelope[0] != key:
+            attributes = ''
+            if key[0]:
+                attributes += ' vfiler="%s"' % api.escape(key[0])
+            attributes += ' version="%s"' % api.escape(key[1])
+            envelope = self._envelope = (
+                key,
+                '<?xml version="1.0" encoding="utf-8"?><netapp%s>' %
+                attributes,
+                '</netapp>',
+            )
+        content = envelope[1] + request + envelope[2]
+        self._log.debug('XML request: %s', content)
+
+        return content.encode('utf-8')
+
+    def _get_parser(self, fields):
+        """Get a :class:`schtob.pyontapi.api.ResponseParser` for `fields` (a
+        list of :class:`schtob.pyontapi.api.NaField` instances or a
+        :class:`schtob.pyontapi.api.ResponseDecoder`).
+        """
+        if not isinstance(fields, api.ResponseDecoder):
+            fields = api.ResponseDecoder(fields)
+        return api.ResponseParser(fields, self._log)
+
+    def _get_headers(self, content):
+        """Return the HTTP headers for a request with body `content`."""
+        headers = [
+            ('Content-Length', str(len(content))),
+            ('Content-type', 'text/xml; charset="UTF-8"'),
+        ]
+
+        if self._settings['style'] == constants.LOGIN:
+            login = '%(user)s:%(password)s' % self._settings
+            encoded = base64.b64encode(login.encode('utf-8'))
+            headers.append(('Authorization',
+                            'Basic %s' % encoded.decode('ascii')))
+        return headers
+
+    def _check_status(self, status):
+        """Raise :class:`errors.HTTPStatusError` for HTTP result `status`
+        other than 200.
+        """
+        if status == 200:
+            return
+        if status in na_http.RESPONSES:
+            raise errors.HTTPStatusError(
+                status, 'HTTP result status %s "%s"' %
+                (status, na_http.RESPONSES[status]))
+        raise errors.HTTPStatusError(status,
+                                     'HTTP result status %s' % status)
+
+    def __request(self, content, feed, expires=None):
+        """POST `content` to the filer and pass the response body to `feed`
+        chunk by chunk as it arrives.
+
+        The request is sent over a pooled keep-alive connection. If the filer
+        has closed a reused connection in the meantime, the request is sent
+        once more over a new connection. No socket operation waits beyond
+        the point in time `expires`.
+        """
+        connection, reused = self.__checkout_connection(expires)
+        # kept, the connection drops its socket if the response closes it
+        sock = connection.sock
+        try:
+            response = self.__post(connection, content)
+        except (socket.error, na_http.HTTPException):
+            self._pool.discard(connection)
+            # the filer may still process a request which timed out
+            if not reused or isinstance(sys.exc_info()[1], socket.timeout):
+                raise self.__get_connection_error(expires)
+            self._log.debug('Connection to filer <%s> was closed, '
+                            'reconnecting', self._filer)
+            self._pool.clear()
+            connection = self.__checkout_connection(expires)[0]
+            sock = connection.sock
+            try:
+                response = self.__post(connection, content)
+            except (socket.error, na_http.HTTPException):
+                self._pool.discard(connection)
+                raise self.__get_connection_error(expires)
 
-        if status != 'passed':
-            errno = results.getAttribute('errno')
-            reason = results.getAttribute('reason')
-            raise errors.APIFailure(errno, reason)
+        if response.status != 200:
+            # the body is not parsed, but needs to be read to reuse the
+            # connection
+            feed = None
+        try:
+            while True:
+                if expires is not None:
+                    sock.settimeout(self._get_timeout('read_timeout',
+                                                      expires, True))
+                data = response.read(RESPONSE_CHUNK_SIZE)
+                if not data:
+                    break
+                if feed is not None:
+                    feed(data)
+        except (socket.error, na_http.HTTPException):
+            self._pool.discard(connection)
+            raise self.__get_connection_error(expires)
+        except:
+            self._pool.discard(connection)
+            raise
+
+        if response.will_close:
+            self._pool.discard(connection)
+        else:
+            self._pool.put(connection)
+
+        self._check_status(response.status)
+
+    def __post(self, connection, content):
+        """Send `content` using `connection` and return the response."""
+        connection.putrequest('POST', self._settings['url'])
+        for name, value in self._get_headers(content):
+            connection.putheader(name, value)
+        connection.endheaders()
+        connection.send(content)
+        return connection.getresponse()
 
-        self._log.debug(results.toprettyxml())
+    def __checkout_connection(self, expires=None):
+        """Get a connected HTTP/HTTPS connection out of the pool and whether
+        it was connected before. New connections may take up to
+        **connect_timeout** seconds; the socket timeout is set to
+        **read_timeout**. Both are limited by the point in time `expires`.
+        """
+        connection = self._pool.get(expires)
+        if connection is None:
+            raise self._get_deadline_error()
+        reused = connection.sock is not None
+        try:
+            if not reused:
+                connection.timeout = self._get_timeout('connect_timeout',
+                                                       expires)
+                connection.connect()
+            connection.sock.settimeout(self._get_timeout('read_timeout',
+                                                         expires))
+        except ssl.SSLError:
+            self._pool.discard(connection)
+            if self._settings['style'] == constants.CERTIFICATE:
+                raise
+            self._fall_back_to_http()
+            return self.__checkout_connection(expires)
+        except socket.error:
+            self._pool.discard(connection)
+            raise self.__get_connection_error(expires)
+        except:
+            self._pool.discard(connection)
+            raise
+
+        if not reused and self._settings['style'] == constants.CERTIFICATE \
+                and self._settings['verify_cn']:
+            if not connection.verify_certificate():
+                self._pool.discard(connection)
+                raise errors.CertificateError()
+        return connection, reused
+
+    def _get_timeout(self, name, expires, unanswered=False):
+        """Get the timeout setting `name` limited to the seconds left until
+        `expires`. If none are left, the deadline error is raised, see
+        :meth:`_get_deadline_error`.
+        """
+        timeout = self._settings[name]
+        if expires is None:
+            return timeout
+        remaining = expires - time.time()
+        if remaining <= 0:
+            raise self._get_deadline_error(unanswered)
+        if timeout is None or remaining < timeout:
+            return remaining
+        return timeout
+
+    def _get_deadline_error(self, unanswered=False):
+        """Get the error for a call exceeding its deadline; `unanswered` is
+        set if it passed while connecting or waiting for the answer.
+        """
+        return errors.DeadlineExceededError(
+            -1, 'Deadline exceeded for filer <%s>' % self._filer, unanswered)
 
-        value = {}
-        for field in fields:
-            value[field.name] = field.get_value(results)
-        return value
+    def __get_connection_error(self, expires):
+        """Get the error to raise for the socket or HTTP exception being
+        handled.
+        """
+        if expires is not None and time.time() >= expires:
+            return self._get_deadline_error(True)
+        return errors.ConnectionFailure(str(sys.exc_info()[1]))
 
     def __get_connection(self):
-        """Returns a HTTP/HTTPS connection instance to the filer."""
+        """Returns a HTTP/HTTPS connection instance to the filer. HTTPS
+        connections share the SSL context of their settings and resume TLS
+        sessions, see :func:`na_http.get_ssl_context`.
+        """
         if self._settings['style'] == constants.CERTIFICATE:
-            return na_http.HTTPSCaConnection(self._filer,
-                                             self._settings['port'],
-                                             self._settings['cert_file'],
-                                             self._settings['ca_file'],
-                                             self._settings['cert_required'])
+            return na_http.HTTPSCaConnection(
+                self._filer, self._settings['port'],
+                key_file=self._settings['key_file'],
+                cert_file=self._settings['cert_file'],
+                ca_file=self._settings['ca_file'],
+                cert_required=self._settings['cert_required'],
+                timeout=self._settings['connect_timeout'])
 
-        conn_cls = na_http.HTTPConnection
         if self._settings['transport_type'] == constants.HTTPS:
-            conn_cls = na_http.HTTPSConnection
-
-        return conn_cls(self._filer, self._settings['port'])
+            return na_http.TLSConnection(
+                self._filer, self._settings['port'], na_http.get_ssl_context(),
+                timeout=self._settings['connect_timeout'])
+        return na_http.HTTPConnection(
+            self._filer, self._settings['port'],
+            timeout=self._settings['connect_timeout'])
 
     def __get_ontapi_version(self):
         """Invokes API call `system-get-ontapi-version` to get the ONTAPI
@@ -277,9 +868,33 @@ class NaFiler(object):
 
     # ---------------------------PRIVATE METHODS-------------------------------
 
-    def __handle_servertype(self):
+    def _fall_back_to_http(self):
+        """Use HTTP after a failed SSL handshake. If several threads fail at
+        the same time, only the first one switches. The default port is
+        adjusted and the transport is kept in :data:`na_http.transport_cache`,
+        so new filer instances use HTTP right away.
+        """
+        self._lock.acquire()
+        try:
+            if self._settings['transport_type'] == constants.HTTP:
+                return
+            self._settings['transport_type'] = constants.HTTP
+            if self._default_port:
+                self._settings['port'] = \
+                    constants.PORTS[self._settings['server_type']]
+            self._pool.clear()
+        finally:
+            self._lock.release()
+        if self._settings['transport_cache_ttl']:
+            na_http.transport_cache.put(
+                self._filer, constants.HTTP,
+                self._settings['transport_cache_ttl'],
+                self._get_transport_cache_path())
+
+    def _handle_servertype(self):
         """Set url and port according to :attr:`settings['server_type']`."""
-        if self._settings['port'] is None:
+        self._default_port = self._settings['port'] is None
+        if self._default_port:
             if self._settings['transport_type'] == constants.HTTPS:
                 if self._settings['server_type'] == 'DFM':
                     self._settings['port'] = 8488
@@ -290,21 +905,64 @@ class NaFiler(object):
                     constants.PORTS[self._settings['server_type']]
         self._settings['url'] = constants.URLS[self._settings['server_type']]
 
+    def _test_https_required(self, settings):
+        """Check if HTTPS should be tested for `settings`.
+
+        HTTPS is tried automatically if `transport_type` is not specified or
+        if it is set to HTTPS.
+        """
+        if not settings or not isinstance(settings, dict):
+            return False
+        return 'transport_type' not in settings or \
+            settings['transport_type'] == constants.HTTPS
+
     def __test_https(self):
-        """Test if a HTTPS connection is possible for this filer."""
+        """Test if a HTTPS connection is possible for this filer. The result
+        is taken out of and kept in :data:`na_http.transport_cache`.
+        """
+        ttl = self._settings['transport_cache_ttl']
+        if ttl:
+            transport_type = na_http.transport_cache.negotiate(
+                self._filer, ttl, self.__probe_https,
+                self._get_transport_cache_path())
+        else:
+            transport_type = self.__probe_https()
+        self._set_https_available(transport_type == constants.HTTPS)
+
+    def __probe_https(self):
+        """Return the transport type depending on whether port 443 of the
+        filer accepts connections.
+        """
         server_socket = socket.socket()
-        server_socket.settimeout(0.25)
+        server_socket.settimeout(HTTPS_TEST_TIMEOUT)
 
         try:
             server_socket.connect((self._filer, 443))
             server_socket.close()
+            return constants.HTTPS
+        except socket.error:
+            return constants.HTTP
+
+    def _get_transport_cache_path(self):
+        """Get the file persisting :data:`na_http.transport_cache` or `None`
+        if there is no **schema_cache_dir**.
+        """
+        if not self._settings['schema_cache_dir']:
+            return None
+        return os.path.join(self._settings['schema_cache_dir'],
+                            TRANSPORT_CACHE_FILE)
+
+    def _set_https_available(self, available):
+        """Set the transport type according to the result of the HTTPS
+        test.
+        """
+        if available:
             self._log.debug('HTTPS test was successful')
             self._settings['transport_type'] = constants.HTTPS
-        except socket.error:
-            if self._settings['transport_type'] == constants.HTTPS:
-                msg = "Fall back to HTTP for filer <%s>; HTTPS was specified!"
-                self._log.warning(msg, self._filer)
-                self._settings['transport_type'] = constants.HTTP
+        elif self._settings['transport_type'] == constants.HTTPS:
+            msg = "Fall back to HTTP for filer <%s>; HTTPS was specified!"
+            self._log.warning(msg, self._filer)
+            self._settings['transport_type'] = constants.HTTP
 
     def __test_settings(self, settings):
         """Check the settings for plausibility."""
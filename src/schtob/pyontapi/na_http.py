@@ -11,45 +11,208 @@
     :license: LGPL, see LICENSE for details.
 """
 
+import json
+import logging
+import os
+import select
 import ssl
 import socket
 import sys
+import tempfile
+import threading
+import time
 
 
 if sys.version_info < (3, 0):
-    from httplib import HTTPConnection, HTTPSConnection
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
 else:
-    from http.client import HTTPConnection, HTTPSConnection
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
 
 
-class HTTPSCaConnection(HTTPSConnection):
-    """HTTPS Connection using client certificates."""
+# SSL contexts by settings profile, see get_ssl_context().
+_ssl_contexts = {}
+_ssl_contexts_lock = threading.Lock()
+
+
+def get_ssl_context(key_file=None, cert_file=None, ca_file=None,
+                    cert_required=False):
+    """Get the SSL context for a settings profile, created on first use.
+
+    Without `cert_file` this is the context of plain HTTPS connections,
+    otherwise the client certificate and key, and the CA file if given, are
+    loaded once and kept for all connections using the same profile.
+    """
+    profile = (key_file or None, cert_file or None, ca_file or None,
+               bool(cert_required))
+    _ssl_contexts_lock.acquire()
+    try:
+        context = _ssl_contexts.get(profile)
+        if context is None:
+            context = _ssl_contexts[profile] = _create_ssl_context(*profile)
+        return context
+    finally:
+        _ssl_contexts_lock.release()
+
+
+def _create_ssl_context(key_file, cert_file, ca_file, cert_required):
+    """Create the SSL context for a profile, see get_ssl_context()."""
+    if cert_file is None:
+        # the same context httplib creates for HTTPSConnection
+        create = getattr(ssl, '_create_default_https_context', None)
+        if create is not None:
+            return create()
+        # older versions of httplib do not verify certificates either
+        return ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    # PROTOCOL_TLS_CLIENT is new in Python 3.6
+    context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_CLIENT',
+                                     ssl.PROTOCOL_SSLv23))
+    if hasattr(context, 'check_hostname'):
+        context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    if cert_required:
+        context.verify_mode = ssl.CERT_REQUIRED
+    context.load_cert_chain(cert_file, key_file)
+    if ca_file is not None:
+        context.load_verify_locations(ca_file)
+    return context
+
+
+class TLSSessionCache(object):
+    """The last TLS session per SSL context, host and port, for resuming
+    sessions instead of full handshakes on new connections.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, context, host, port):
+        """Get the session to resume for a connection or `None`."""
+        self._lock.acquire()
+        try:
+            return self._sessions.get((id(context), host, port))
+        finally:
+            self._lock.release()
+
+    def put(self, context, host, port, session):
+        """Remember `session` of a connection."""
+        self._lock.acquire()
+        try:
+            self._sessions[(id(context), host, port)] = session
+        finally:
+            self._lock.release()
+
+    def discard(self, context, host, port):
+        """Forget the session of a connection."""
+        self._lock.acquire()
+        try:
+            self._sessions.pop((id(context), host, port), None)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Forget all sessions."""
+        self._lock.acquire()
+        try:
+            self._sessions.clear()
+        finally:
+            self._lock.release()
 
-    def __init__(self, host, port, key_file, cert_file, ca_file,
-                 cert_required=False, timeout=1.0):
-        if sys.version_info < (2, 6):
-            HTTPSConnection.__init__(self, host, port, key_file, cert_file)
-        else:
-            HTTPSConnection.__init__(self, host, port, key_file, cert_file,
-                                     timeout=timeout)
-        self._ca_file = ca_file
-        self._cert_required = cert_required
+
+# TLS sessions of this process, see :class:`TLSConnection`.
+tls_sessions = TLSSessionCache()
+
+
+class TLSConnection(HTTPSConnection):
+    """HTTPS Connection using the shared SSL `context` of its settings
+    profile, see :func:`get_ssl_context`.
+
+    The TLS session is kept in :data:`tls_sessions` and resumed by the next
+    connection to the same host and port. Tunnelling through a proxy with
+    :meth:`set_tunnel` is supported.
+    """
+
+    def __init__(self, host, port, context,
+                 timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        HTTPSConnection.__init__(self, host, port, timeout=timeout,
+                                 context=context)
+        self.ssl_context = context
 
     def connect(self):
-        """Connect to the host and port specified in __init__."""
+        """Connect to the host and port specified in __init__, resuming the
+        last TLS session if possible.
+        """
+        host, port = self.__get_peer()
+        session = tls_sessions.get(self.ssl_context, host, port)
+        try:
+            self.__connect(session)
+        except ssl.SSLError:
+            if session is None:
+                raise
+            # the session may have expired or been dropped by the filer
+            tls_sessions.discard(self.ssl_context, host, port)
+            self.__connect(None)
+
+    def getresponse(self):
+        """Get the response and keep the TLS session; TLS 1.3 session
+        tickets only arrive with the first response.
+        """
+        response = HTTPSConnection.getresponse(self)
+        self.__keep_session()
+        return response
+
+    def close(self):
+        """Close the connection, keeping the TLS session."""
+        self.__keep_session()
+        HTTPSConnection.close(self)
+
+    def __get_peer(self):
+        """Get host and port of the TLS peer, which is behind the proxy if
+        tunnelling.
+        """
+        if getattr(self, '_tunnel_host', None):
+            return self._tunnel_host, self._tunnel_port
+        return self.host, self.port
+
+    def __connect(self, session):
+        """Open the socket, set up the tunnel if any and do the TLS
+        handshake.
+        """
         sock = socket.create_connection((self.host, self.port), self.timeout)
+        kwargs = {'server_hostname': self.__get_peer()[0]}
+        if session is not None:
+            kwargs['session'] = session
+        try:
+            if getattr(self, '_tunnel_host', None):
+                self.sock = sock
+                self._tunnel()
+            self.sock = self.ssl_context.wrap_socket(sock, **kwargs)
+        except:
+            self.sock = None
+            sock.close()
+            raise
+
+    def __keep_session(self):
+        """Keep the session of the socket for later connections."""
+        session = getattr(self.sock, 'session', None)
+        if session is not None:
+            host, port = self.__get_peer()
+            tls_sessions.put(self.ssl_context, host, port, session)
 
-        if self._cert_required:
-            self.sock = ssl.wrap_socket(sock, self.key_file, self.cert_file,
-                                        ca_certs=self._ca_file,
-                                        cert_reqs=ssl.CERT_REQUIRED)
-        else:
-            self.sock = ssl.wrap_socket(sock, self.key_file, self.cert_file,
-                                        ca_certs=self._ca_file)
+
+class HTTPSCaConnection(TLSConnection):
+    """HTTPS Connection using client certificates."""
+
+    def __init__(self, host, port, key_file, cert_file, ca_file,
+                 cert_required=False, timeout=1.0):
+        TLSConnection.__init__(
+            self, host, port,
+            get_ssl_context(key_file, cert_file, ca_file, cert_required),
+            timeout)
 
     def peer_common_name(self):
         """Get the certificate common name."""
-        for val in self.sock.getpeercert()['subject']:
+        for val in self.sock.getpeercert().get('subject', ()):
             if val[0][0].lower() == 'commonname':
                 return val[0][1]
         return ''
@@ -59,6 +222,250 @@ class HTTPSCaConnection(HTTPSConnection):
         return self.peer_common_name().lower() == self.host.lower()
 
 
+class ConnectionPool(object):
+    """Pool of persistent HTTP/1.1 keep-alive connections to a single filer.
+
+    `factory` is called without arguments whenever a new connection is
+    needed. At most `size` connections are handed out at the same time; a
+    `size` of 0 disables keep-alive, i.e. every connection is closed when it
+    is given back. Idle connections are closed after `idle_timeout` seconds.
+    """
+
+    def __init__(self, factory, size=4, idle_timeout=30.0):
+        self._factory = factory
+        self._size = size
+        self._idle_timeout = idle_timeout
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+    def get(self, expires=None):
+        """Check out a connection.
+
+        Idle connections are health checked first; if none is usable, a new
+        connection is created. Blocks while the pool is exhausted, but
+        returns `None` once the point in time `expires` has passed.
+        """
+        self._cond.acquire()
+        try:
+            while True:
+                self._evict_idle()
+                while self._idle:
+                    connection = self._idle.pop()[0]
+                    if is_connection_alive(connection):
+                        self._in_use += 1
+                        return connection
+                    connection.close()
+                if not self._size or self._in_use < self._size:
+                    self._in_use += 1
+                    break
+                if expires is None:
+                    self._cond.wait()
+                else:
+                    remaining = expires - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._cond.wait(remaining)
+        finally:
+            self._cond.release()
+
+        try:
+            return self._factory()
+        except:
+            self._release()
+            raise
+
+    def put(self, connection):
+        """Give `connection` back to the pool."""
+        if not self._size:
+            connection.close()
+            self._release()
+            return
+        self._cond.acquire()
+        try:
+            self._in_use -= 1
+            self._idle.append((connection, time.time()))
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def discard(self, connection):
+        """Close `connection` and free its slot in the pool."""
+        connection.close()
+        self._release()
+
+    def clear(self):
+        """Close all idle connections."""
+        self._cond.acquire()
+        try:
+            while self._idle:
+                self._idle.pop()[0].close()
+        finally:
+            self._cond.release()
+
+    def _release(self):
+        """Free a slot without putting a connection back."""
+        self._cond.acquire()
+        try:
+            self._in_use -= 1
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def _evict_idle(self):
+        """Close connections which were idle for more than `idle_timeout`."""
+        if self._idle_timeout is None:
+            return
+        limit = time.time() - self._idle_timeout
+        while self._idle and self._idle[0][1] < limit:
+            self._idle.pop(0)[0].close()
+
+
+def is_connection_alive(connection):
+    """Check if the socket of an idle `connection` is still usable.
+
+    An idle keep-alive socket must not be readable; if it is, the filer has
+    either closed the connection or sent unexpected data.
+    """
+    if connection.sock is None:
+        return True
+    try:
+        readable = select.select([connection.sock], [], [], 0)[0]
+    except (select.error, socket.error, ValueError):
+        return False
+    return not readable
+
+
+# Default number of seconds the negotiated transport of a host is kept.
+TRANSPORT_CACHE_TTL = 3600.0
+
+
+class TransportCache(object):
+    """Transport types (HTTP or HTTPS) negotiated per host, each kept for
+    a time to live.
+
+    Entries can be persisted to a JSON file `path` passed to the methods;
+    the file is read on first use and rewritten on each change.
+    """
+
+    def __init__(self):
+        # host: (transport_type, expires)
+        self._entries = {}
+        self._loaded = set()
+        self._host_locks = {}
+        self._lock = threading.Lock()
+        self._log = logging.getLogger('pyontapi')
+
+    def get(self, host, path=None):
+        """Get the transport type negotiated for `host` or `None`."""
+        self._lock.acquire()
+        try:
+            if path is not None and path not in self._loaded:
+                self.__load(path)
+            entry = self._entries.get(host)
+            if entry is None or entry[1] <= time.time():
+                return None
+            return entry[0]
+        finally:
+            self._lock.release()
+
+    def put(self, host, transport_type, ttl, path=None):
+        """Remember `transport_type` for `host` for `ttl` seconds."""
+        self._lock.acquire()
+        try:
+            if path is not None and path not in self._loaded:
+                self.__load(path)
+            self._entries[host] = (transport_type, time.time() + ttl)
+            if path is not None:
+                self.__save(path)
+        finally:
+            self._lock.release()
+
+    def negotiate(self, host, ttl, probe, path=None):
+        """Get the transport type for `host`, calling `probe` to find it
+        out if it is not known. Threads negotiating the same host wait for
+        the first one.
+        """
+        self._lock.acquire()
+        try:
+            host_lock = self._host_locks.setdefault(host, threading.Lock())
+        finally:
+            self._lock.release()
+
+        host_lock.acquire()
+        try:
+            transport_type = self.get(host, path)
+            if transport_type is None:
+                transport_type = probe()
+                self.put(host, transport_type, ttl, path)
+            return transport_type
+        finally:
+            host_lock.release()
+
+    def clear(self):
+        """Forget all entries; files are read again on next use."""
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._loaded.clear()
+        finally:
+            self._lock.release()
+
+    def __load(self, path):
+        """Merge the valid entries of file `path`."""
+        self._loaded.add(path)
+        try:
+            handle = open(path)
+            try:
+                entries = json.load(handle)
+            finally:
+                handle.close()
+        except (IOError, OSError, ValueError):
+            return
+        now = time.time()
+        for host, entry in entries.items():
+            try:
+                transport_type, expires = entry
+            except (TypeError, ValueError):
+                continue
+            if expires > now and host not in self._entries:
+                self._entries[host] = (transport_type, expires)
+
+    def __save(self, path):
+        """Write the valid entries to file `path`, keeping the entries other
+        processes added meanwhile.
+        """
+        self.__load(path)
+        now = time.time()
+        entries = dict([(host, list(entry))
+                        for host, entry in self._entries.items()
+                        if entry[1] > now])
+        directory = os.path.dirname(path) or os.curdir
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            handle, temp_path = tempfile.mkstemp(dir=directory,
+                                                 suffix='.tmp')
+            try:
+                os.write(handle, json.dumps(entries).encode('utf-8'))
+            finally:
+                os.close(handle)
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                # Windows does not replace existing files
+                os.remove(path)
+                os.rename(temp_path, path)
+        except (IOError, OSError):
+            self._log.warning('Cannot write transport cache %s: %s', path,
+                              sys.exc_info()[1])
+
+
+# Transports negotiated in this process, see
+# :meth:`schtob.pyontapi.NaFiler._setup`.
+transport_cache = TransportCache()
+
+
 RESPONSES = {
     100: 'Continue',
     101: 'Switching Protocols',
@@ -11,43 +11,274 @@
     :license: LGPL, see LICENSE for details.
 """
 
+import fnmatch
+import hashlib
+import json
+import logging
+import os
 import sys
+import tempfile
+import threading
+import time
 
 from schtob.pyontapi import errors, api, system
 
 _verbose = False
 
+# Default size limit of the schema cache in bytes.
+SCHEMA_CACHE_SIZE = 64 * 1024 * 1024
+
+# Number of API catalogs kept in memory by :data:`schema_registry`.
+SCHEMA_REGISTRY_SIZE = 16
+
+# Default number of API commands per `system-api-get-elements` request, the
+# number of requests sent concurrently and the retries per request.
+ELEMENTS_CHUNK_SIZE = 500
+ELEMENTS_WORKERS = 4
+ELEMENTS_RETRIES = 2
+
+# Seconds to wait before retrying a `system-api-get-elements` request,
+# multiplied by the number of the attempt.
+ELEMENTS_RETRY_DELAY = 0.5
+
 
 def generate(filer):
-    """Generate API commands for `filer`'s version."""
+    """Generate API commands for `filer`'s version. Returns a dict
+    containing all packages, see :func:`get_catalog`.
+    """
+    return get_catalog(filer).packages
 
-    package = system.System(filer)
-    typedefs = gen_typedefs(package)
+
+def get_catalog(filer):
+    """Get the :class:`APICatalog` for `filer`'s version.
+
+    If the `schema_cache_dir` setting is set, the API types and elements are
+    taken out of the :class:`SchemaCache` if the filer's ONTAPI version did
+    not change. If the `share_schema` setting is set, the catalog is shared
+    with other filers through :data:`schema_registry`; `system-api-list` is
+    only requested for that if `cmd_list` is empty or holds packages or
+    patterns. See :class:`CatalogBuilder`.
+    """
+
+    builder = CatalogBuilder(filer)
     if _verbose:
-        print("generate: Filer settings: <%s>" % filer.settings)
-    if 'cmd_list' in filer.settings:
-        return get_api_command_packages(package, typedefs,
-                                        cmd_list=filer.settings['cmd_list'])
-    else:
-        return get_api_command_packages(package, typedefs)
+        print("generate: Filer settings: <%s>" % builder.settings)
+    catalog = builder.load()
+    if catalog is not None:
+        return catalog
+
+    package = system.System(filer)
+    if builder.needs_api_list:
+        builder.set_api_names(get_api_names(package))
+
+    def create():
+        types = get_api_types(package)
+        try:
+            elements = fetch_api_elements(
+                package.api_get_elements, builder.get_chunks(),
+                builder.workers, builder.retries)
+        except errors.APIFailure:
+            raise api_elements_error(sys.exc_info()[1])
+        return APICatalog(types, elements)
+
+    return builder.store(builder.get_shared(create))
+
+
+class CatalogBuilder(object):
+    """The steps of getting the :class:`APICatalog` for `filer` which do
+    not send requests, shared by :func:`get_catalog` and
+    :func:`schtob.pyontapi.na_async.get_catalog`.
+
+    :meth:`load` takes the catalog out of the schema cache. Otherwise,
+    the command names of `system-api-list` are passed to
+    :meth:`set_api_names` if :attr:`needs_api_list` is set. A catalog
+    shared by another filer is taken by :meth:`get_shared` or
+    :meth:`find`; a new one is built out of `system-api-list-types` and
+    `system-api-get-elements` for the :meth:`get_chunks` and registered by
+    :meth:`get_shared` or :meth:`share`. :meth:`store` writes it to the
+    schema cache.
+    """
+
+    def __init__(self, filer):
+        self.filer = filer
+        self.settings = filer.settings
+        self.cmd_list = self.settings.get('cmd_list')
+        # with exact command names, the list of API commands does not matter
+        self.needs_api_list = not self.cmd_list or \
+            has_patterns(self.cmd_list)
+        self.api_hash = None
+        self.workers = self.settings.get('elements_workers', ELEMENTS_WORKERS)
+        self.retries = self.settings.get('elements_retries', ELEMENTS_RETRIES)
+        self._share = self.settings.get('share_schema')
+        self._cache = SchemaCache.from_settings(self.settings)
+
+    def load(self):
+        """Get the catalog out of the schema cache or `None`."""
+        if self._cache is None:
+            return None
+        entry = self._cache.load(self.filer)
+        if entry is None:
+            return None
+        types, elements, api_hash = entry
+        if self._share and (api_hash or not self.needs_api_list):
+            return schema_registry.get(
+                get_registry_key(self.settings, api_hash),
+                lambda: APICatalog(types, elements))
+        return APICatalog(types, elements)
+
+    def set_api_names(self, api_names):
+        """Resolve `cmd_list` against the `system-api-list` command names
+        `api_names`, see :func:`resolve_cmd_list`.
+        """
+        self.cmd_list = resolve_cmd_list(self.cmd_list, api_names)
+        if self._share:
+            self.api_hash = hashlib.sha1(
+                ' '.join(sorted(api_names)).encode('utf-8')).hexdigest()
+
+    def get_shared(self, create):
+        """Get the catalog shared through :data:`schema_registry`, calling
+        `create` to get it if it is not registered or `share_schema` is not
+        set.
+        """
+        if not self._share:
+            return create()
+        return schema_registry.get(
+            get_registry_key(self.settings, self.api_hash), create)
+
+    def find(self):
+        """Get the catalog shared through :data:`schema_registry` or
+        `None`.
+        """
+        if not self._share:
+            return None
+        return schema_registry.find(
+            get_registry_key(self.settings, self.api_hash))
+
+    def share(self, catalog):
+        """Register `catalog` in :data:`schema_registry` and return it, or
+        the catalog registered meanwhile.
+        """
+        return self.get_shared(lambda: catalog)
+
+    def get_chunks(self):
+        """Get the chunks of `cmd_list` for `system-api-get-elements`, see
+        :func:`get_elements_chunks`.
+        """
+        return get_elements_chunks(self.cmd_list, self.settings)
+
+    def store(self, catalog):
+        """Write `catalog` to the schema cache and return it."""
+        if self._cache is not None:
+            self._cache.store(self.filer, catalog.types, catalog.elements,
+                              self.api_hash)
+        return catalog
+
+
+def get_registry_key(settings, api_hash):
+    """Get the :data:`schema_registry` key for a filer with `settings` whose
+    `system-api-list` command names hash to `api_hash`. Filers share a
+    catalog if they have the same server type, ONTAPI version, `cmd_list`
+    and list of available API commands. If `cmd_list` holds exact command
+    names only, `api_hash` is `None`.
+    """
+    cmd_list = settings.get('cmd_list')
+    return (settings['server_type'], settings['ontapi_version'], api_hash,
+            cmd_list and tuple(sorted(cmd_list)) or None)
+
+
+class APICatalog(object):
+    """API command packages built out of the `types`
+    (`system-api-list-types`) and `elements` (`system-api-get-elements`)
+    results.
+
+    A catalog is shared by all filers with the same schema and must not be
+    modified. The API classes for its packages are created once, see
+    :meth:`get_api_class`.
+    """
+
+    def __init__(self, types, elements):
+        self.types = prune_types(types, elements)
+        self.elements = elements
+        self.packages = build_api_command_packages(elements,
+                                                   build_typedefs(self.types))
+        self._api_classes = {}
+        self._lock = threading.Lock()
+
+    def get_api_class(self, base_class, package_name):
+        """Get the subclass of `base_class` with the API commands of package
+        `package_name` as methods.
+        """
+        key = (base_class, package_name)
+        self._lock.acquire()
+        try:
+            if key not in self._api_classes:
+                self._api_classes[key] = base_class.for_commands(
+                    '%s_%s' % (base_class.__name__, package_name),
+                    self.packages[package_name])
+            return self._api_classes[key]
+        finally:
+            self._lock.release()
 
 
 def gen_typedefs(package):
     """Generate typedef classes."""
-    typedefs = {}
+    return build_typedefs(get_api_types(package))
+
+
+def get_api_types(package):
+    """Invoke `system-api-list-types` and return the result."""
     try:
-        result = package.get_api_list_types()
+        return package.get_api_list_types()
     except errors.APIFailure:
-        exc = sys.exc_info()[1]
-        raise errors.APIGenerationError(exc.errno,
-                                        'cannot get api types! Error was:\n%s' %
-                                        exc.reason)
+        raise api_types_error(sys.exc_info()[1])
+
+
+def api_types_error(exc):
+    """Return the error raised if `system-api-list-types` failed."""
+    return errors.APIGenerationError(exc.errno,
+                                     'cannot get api types! Error was:\n%s' %
+                                     exc.reason)
+
+
+def prune_types(types, elements):
+    """Return the `system-api-list-types` result `types` reduced to the
+    types reachable from the commands in the `system-api-get-elements`
+    result `elements`.
+    """
+    entries = {}
+    for entry in types['type-entries']:
+        entries[entry['name']] = entry
+
+    reachable = set()
+    pending = []
+    for child in elements['api-entries']:
+        for info in child.get('api-elements') or ():
+            pending.append(info['type'])
+    while pending:
+        name = (pending.pop() or 'string').replace('[]', '')
+        if name in reachable or name not in entries:
+            continue
+        reachable.add(name)
+        for info in entries[name]['type-elements']:
+            pending.append(info['type'])
+
+    if len(reachable) == len(entries):
+        return types
+    pruned = dict(types)
+    pruned['type-entries'] = [entry for entry in types['type-entries']
+                              if entry['name'] in reachable]
+    return pruned
 
+
+def build_typedefs(result):
+    """Generate typedef classes out of a `system-api-list-types` `result`."""
+    typedefs = {}
     for element in result['type-entries']:
         typedefs[element['name']] = api.NamedType(
             element['name'], element['type-elements']
         )
 
+    interned = {}
     for typedef in typedefs.values():
         elements = []
         for element in typedef.elements:
@@ -58,61 +289,470 @@ def gen_typedefs(package):
                 var_type = api.GENERIC_TYPEDEFS[var_type]
             else:
                 var_type = typedefs[var_type]
-            _element = api.TypeDef(element, var_type)
-            elements.append(_element)
+            elements.append(get_typedef(interned, element, var_type))
         typedef.elements = elements
     return typedefs
 
 
+def get_typedef(interned, info, var_type):
+    """Get the :class:`schtob.pyontapi.api.TypeDef` for element `info` of
+    type `var_type`. Equal element definitions share one instance out of the
+    dict `interned`.
+    """
+    key = (info.get('name'), info.get('type'),
+           info.get('encrypted', False) or False,
+           info.get('is-nonempty', False) or False,
+           info.get('is-optional', False) or False,
+           info.get('is-output', False) or False)
+    try:
+        return interned[key]
+    except KeyError:
+        typedef = interned[key] = api.TypeDef(info, var_type)
+        return typedef
+
+
 def get_api_command_packages(package, typedefs, cmd_list=None):
     """Get all api commands for `filer`. Returns a dict containing all
     packages.
     If cmd_list is given, we do not ask for all commands;
     only for the given commands in the cmd_list
     """
+    return build_api_command_packages(get_api_elements(package, cmd_list),
+                                      typedefs)
 
-    if not cmd_list:
-        try:
-            result = package.api_list()
-        except errors.APIFailure:
-            exc = sys.exc_info()[1]
-            raise errors.OntapiVersionError(
-                exc.errno, 'Can not run system-api-list. Error was:\n%s' %
-                exc.reason)
-        cmd_list = [child['name'] for child in result['apis']]
+
+def get_api_elements(package, cmd_list=None, api_names=None, settings=None):
+    """Invoke `system-api-get-elements` for all commands in `cmd_list` and
+    return the result. If `cmd_list` is not given, all commands returned by
+    `system-api-list` are used. Patterns in `cmd_list` are resolved against
+    `api_names` or the result of `system-api-list`, see
+    :func:`resolve_cmd_list`.
+
+    The commands are requested in chunks, see :func:`get_elements_chunks`
+    and :func:`fetch_api_elements`.
+    """
+
+    if not cmd_list or has_patterns(cmd_list):
+        if api_names is None:
+            api_names = get_api_names(package)
+        cmd_list = resolve_cmd_list(cmd_list, api_names)
     elif _verbose:
         print("get_api_command_packages: cmd_list given\n", cmd_list)
 
+    settings = settings or {}
     try:
-        result = package.api_get_elements(cmd_list)
+        return fetch_api_elements(
+            package.api_get_elements, get_elements_chunks(cmd_list, settings),
+            settings.get('elements_workers', ELEMENTS_WORKERS),
+            settings.get('elements_retries', ELEMENTS_RETRIES))
     except errors.APIFailure:
-        exc = sys.exc_info()[1]
-        raise errors.OntapiVersionError(
-            exc.errno, 'Can not get api elements. Error was:\n%s' % exc.reason)
+        raise api_elements_error(sys.exc_info()[1])
+
+
+def get_elements_chunks(cmd_list, settings):
+    """Split `cmd_list` into chunks of at most `elements_chunk_size`
+    commands (0 disables chunking).
+    """
+    size = settings.get('elements_chunk_size', ELEMENTS_CHUNK_SIZE)
+    if not size or len(cmd_list) <= size:
+        return [cmd_list]
+    return [cmd_list[i:i + size] for i in range(0, len(cmd_list), size)]
+
+
+def fetch_api_elements(get_elements, chunks, max_workers, retries):
+    """Call `get_elements` (`system-api-get-elements`) for each of the
+    command lists `chunks` in at most `max_workers` threads and return the
+    merged results, see :func:`merge_api_elements`.
+
+    A failed request is retried up to `retries` times. If it still fails,
+    the remaining chunks are not requested and the error is raised.
+    """
+    results = [None] * len(chunks)
+    pending = list(range(len(chunks)))
+    failures = []
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            lock.acquire()
+            try:
+                if failures or not pending:
+                    return
+                index = pending.pop(0)
+            finally:
+                lock.release()
+            try:
+                results[index] = get_with_retries(get_elements, chunks[index],
+                                                  retries)
+            except Exception:
+                lock.acquire()
+                try:
+                    failures.append(sys.exc_info()[1])
+                finally:
+                    lock.release()
+                return
+
+    threads = []
+    for _ in range(min(max_workers, len(chunks)) - 1):
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    work()
+    for thread in threads:
+        thread.join()
+    if failures:
+        raise failures[0]
+    return merge_api_elements(results)
 
+
+def get_with_retries(get_elements, cmd_list, retries):
+    """Call `get_elements` for `cmd_list`, retrying up to `retries` times
+    on :class:`schtob.pyontapi.errors.APIFailure`.
+    """
+    attempt = 0
+    while True:
+        try:
+            return get_elements(cmd_list)
+        except errors.APIFailure:
+            attempt += 1
+            delay = get_retry_delay(cmd_list, sys.exc_info()[1], attempt,
+                                    retries)
+            if delay is None:
+                raise
+            time.sleep(delay)
+
+
+def get_retry_delay(cmd_list, exc, attempt, retries):
+    """Get the seconds to wait before retry `attempt` (counting from 1) of
+    the `system-api-get-elements` request for `cmd_list` which failed with
+    `exc`, or `None` if more than `retries` retries would be needed. The
+    retry is logged.
+    """
+    if attempt > retries:
+        return None
+    logging.getLogger('pyontapi').warning(
+        'system-api-get-elements for %d commands failed, retry %d: '
+        '%s (%s)', len(cmd_list), attempt, exc.reason, exc.errno)
+    return ELEMENTS_RETRY_DELAY * attempt
+
+
+def merge_api_elements(results):
+    """Merge the `system-api-get-elements` `results` of several chunks."""
+    if len(results) == 1:
+        return results[0]
+    merged = dict(results[0])
+    merged['api-entries'] = []
+    for result in results:
+        merged['api-entries'].extend(result['api-entries'])
+    return merged
+
+
+def is_pattern(name):
+    """Check if `name` in `cmd_list` is a package name (no dash) or a glob
+    pattern rather than an API command name.
+    """
+    return '-' not in name or is_glob(name)
+
+
+def is_glob(name):
+    """Check if `name` contains glob wildcards."""
+    return '*' in name or '?' in name or '[' in name
+
+
+def has_patterns(cmd_list):
+    """Check if `cmd_list` contains package names or glob patterns."""
+    for name in cmd_list:
+        if is_pattern(name):
+            return True
+    return False
+
+
+def resolve_cmd_list(cmd_list, api_names):
+    """Resolve the package names and glob patterns (e.g. ``volume``,
+    ``volume-*`` or ``snapmirror-get-*``) in `cmd_list` against the command
+    names `api_names` of `system-api-list`. Command names are kept as they
+    are. Returns all of `api_names` if `cmd_list` is empty.
+    """
+    if not cmd_list:
+        return list(api_names)
+    names = []
+    patterns = []
+    for name in cmd_list:
+        if not is_pattern(name):
+            names.append(name)
+        elif not is_glob(name):
+            # package name
+            patterns.append(name + '-*')
+        else:
+            patterns.append(name)
+    seen = set(names)
+    for api_name in api_names:
+        if api_name in seen:
+            continue
+        for pattern in patterns:
+            if fnmatch.fnmatchcase(api_name, pattern):
+                names.append(api_name)
+                seen.add(api_name)
+                break
+    return names
+
+
+def get_api_names(package):
+    """Invoke `system-api-list` and return the command names."""
+    try:
+        return get_command_names(package.api_list())
+    except errors.APIFailure:
+        raise api_list_error(sys.exc_info()[1])
+
+
+def api_list_error(exc):
+    """Return the error raised if `system-api-list` failed."""
+    return errors.OntapiVersionError(
+        exc.errno, 'Can not run system-api-list. Error was:\n%s' % exc.reason)
+
+
+def api_elements_error(exc):
+    """Return the error raised if `system-api-get-elements` failed."""
+    return errors.OntapiVersionError(
+        exc.errno, 'Can not get api elements. Error was:\n%s' % exc.reason)
+
+
+def get_command_names(result):
+    """Get all command names out of a `system-api-list` `result`."""
+    return [child['name'] for child in result['apis']]
+
+
+def build_api_command_packages(result, typedefs):
+    """Generate the API command packages out of a `system-api-get-elements`
+    `result`. Returns a dict containing all packages.
+    """
     packages = {}
+    # named types are shared by all commands instead of being duplicated;
+    # the elements of named types do not depend on the command
+    interned = {}
 
     for child in result['api-entries']:
         name = child['name']
         elements = []
         if 'api-elements' in child:
-            for element_info in child['api-elements']:
-                info = {}
-                for key, value in element_info.items():
-                    info[key] = value
+            for info in child['api-elements']:
                 var_type = info['type'].replace('[]', '')
                 if var_type in api.GENERIC_TYPEDEFS:
                     var_type = api.GENERIC_TYPEDEFS[var_type]
                 else:
-                    var_type = typedefs[var_type].duplicate()
-                typedef = api.TypeDef(info, var_type)
-                if isinstance(var_type, api.NamedType):
-                    var_type.set_output_value_for_childs(
-                        typedef.is_optional
-                    )
-                elements.append(typedef)
+                    var_type = typedefs[var_type]
+                elements.append(get_typedef(interned, info, var_type))
         api_command = api.APICommand(name, elements)
         if not api_command.get_package() in packages:
             packages[api_command.get_package()] = []
         packages[api_command.get_package()].append(api_command)
-    return packages
\ No newline at end of file
+    return packages
+
+
+class SchemaCache(object):
+    """On-disk cache for the results of `system-api-list-types` and
+    `system-api-get-elements`.
+
+    There is one entry per filer, server type, vfiler, user and `cmd_list`.
+    Each entry records the ONTAPI version it was generated for and is only
+    used as long as the filer reports the same version; after an upgrade it
+    is rebuilt. If the cache grows beyond `max_size` bytes, the least
+    recently used entries are removed.
+    """
+
+    FORMAT = 2
+
+    def __init__(self, directory, max_size=SCHEMA_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self._log = logging.getLogger('pyontapi')
+
+    def from_settings(cls, settings):
+        """Get the cache configured in `settings` or `None` if caching is
+        disabled.
+        """
+        if not settings.get('schema_cache_dir'):
+            return None
+        return cls(settings['schema_cache_dir'],
+                   settings.get('schema_cache_size', SCHEMA_CACHE_SIZE))
+
+    from_settings = classmethod(from_settings)
+
+    def get_path(self, filer):
+        """Get the path of the cache entry for `filer`."""
+        settings = filer.settings
+        cmd_list = settings.get('cmd_list')
+        if cmd_list:
+            cmd_list = sorted(cmd_list)
+        key = repr((filer.host, settings['server_type'], settings['vfiler'],
+                    settings['user'], cmd_list))
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, 'schema-%s.json' % digest)
+
+    def load(self, filer):
+        """Return the cached ``(types, elements, api_hash)`` for `filer` or
+        `None` if there is no valid entry. `api_hash` identifies the list of
+        API commands (see :func:`get_catalog`) and may be `None`.
+        """
+        path = self.get_path(filer)
+        try:
+            handle = open(path)
+            try:
+                entry = json.load(handle)
+            finally:
+                handle.close()
+        except (IOError, OSError, ValueError):
+            return None
+
+        if entry.get('format') != self.FORMAT or \
+                entry.get('ontapi_version') != \
+                filer.settings['ontapi_version']:
+            self._log.debug('Schema cache entry %s is outdated', path)
+            return None
+
+        try:
+            # mark entry as recently used
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry['types'], entry['elements'], entry.get('api_hash')
+
+    def store(self, filer, types, elements, api_hash=None):
+        """Store the `types` and `elements` results for `filer`."""
+        path = self.get_path(filer)
+        entry = {
+            'format': self.FORMAT,
+            'ontapi_version': filer.settings['ontapi_version'],
+            'api_hash': api_hash,
+            'types': types,
+            'elements': elements,
+        }
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            handle, temp_path = tempfile.mkstemp(dir=self.directory,
+                                                 suffix='.tmp')
+            try:
+                os.write(handle, json.dumps(entry).encode('utf-8'))
+            finally:
+                os.close(handle)
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                # Windows does not replace existing files
+                os.remove(path)
+                os.rename(temp_path, path)
+        except (IOError, OSError):
+            exc = sys.exc_info()[1]
+            self._log.warning('Cannot write schema cache entry %s: %s',
+                              path, exc)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is not
+        larger than :attr:`max_size`. The most recent entry is always kept.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.startswith('schema-') or not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        total = sum([entry[1] for entry in entries])
+        while total > self.max_size and len(entries) > 1:
+            size, path = entries.pop(0)[1:]
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+class SchemaRegistry(object):
+    """In-process registry of :class:`APICatalog` instances, holding at most
+    `max_entries` catalogs.
+
+    If several threads ask for the same missing key, the catalog is created
+    only once and the others wait for it.
+    """
+
+    def __init__(self, max_entries=SCHEMA_REGISTRY_SIZE):
+        self.max_entries = max_entries
+        self._entries = {}
+        # keys in order of use, least recently used first
+        self._order = []
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, create):
+        """Return the catalog for `key`, calling `create` to get it if it is
+        not registered.
+        """
+        self._lock.acquire()
+        try:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        finally:
+            self._lock.release()
+
+        key_lock.acquire()
+        try:
+            catalog = self.__lookup(key)
+            if catalog is None:
+                catalog = create()
+                self.__store(key, catalog)
+            return catalog
+        finally:
+            key_lock.release()
+
+    def find(self, key):
+        """Return the catalog for `key` or `None`."""
+        return self.__lookup(key)
+
+    def clear(self):
+        """Forget all catalogs."""
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._order = []
+            self._key_locks.clear()
+        finally:
+            self._lock.release()
+
+    def __lookup(self, key):
+        """Return the catalog for `key` or `None`."""
+        self._lock.acquire()
+        try:
+            if key not in self._entries:
+                return None
+            self._order.remove(key)
+            self._order.append(key)
+            return self._entries[key]
+        finally:
+            self._lock.release()
+
+    def __store(self, key, catalog):
+        """Register `catalog` for `key` and forget the least recently used
+        catalogs.
+        """
+        self._lock.acquire()
+        try:
+            self._entries[key] = catalog
+            self._order.append(key)
+            while len(self._order) > self.max_entries:
+                old_key = self._order.pop(0)
+                self._entries.pop(old_key)
+                self._key_locks.pop(old_key, None)
+        finally:
+            self._lock.release()
+
+
+# Catalogs shared between filers, see :func:`get_catalog`.
+schema_registry = SchemaRegistry()
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+    schtob.pyontapi.result_cache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Cache for the results of read-only API commands and coalescing of
+    identical concurrent requests, see the `result_cache_*` and
+    `coalesce_requests` settings of :class:`schtob.pyontapi.NaFiler`.
+
+    :copyright: 2010-2015 Schaefer & Tobies SuC GmbH.
+    :author: Markus Grimm <mgr@schaefer-tobies.de>;
+             Uwe W. Schaefer <uws@schaefer-tobies.de>
+    :license: LGPL, see LICENSE for details.
+"""
+
+import collections
+import copy
+import fnmatch
+import sys
+import threading
+import time
+
+from schtob.pyontapi import errors
+
+# Default time to live in seconds of cached results.
+RESULT_CACHE_TTL = 30.0
+
+# Words in API command names which mark read-only commands.
+READ_WORDS = frozenset(['get', 'list', 'info', 'status', 'show'])
+
+# Suffixes of iterator session commands; they are neither cached nor
+# invalidate the cache.
+SESSION_SUFFIXES = ('-iter-start', '-iter-next', '-iter-end')
+
+
+def is_read_only(api_command_name):
+    """Check if `api_command_name` only reads, judging by its name."""
+    return bool(READ_WORDS.intersection(api_command_name.split('-')[1:]))
+
+
+def is_session_command(api_command_name):
+    """Check if `api_command_name` is part of an iterator session."""
+    return api_command_name.endswith(SESSION_SUFFIXES)
+
+
+def is_coalescable(api_command_name):
+    """Check if concurrent identical calls of `api_command_name` may share
+    one request: read-only commands outside of iterator sessions.
+    """
+    return is_read_only(api_command_name) and \
+        not is_session_command(api_command_name)
+
+
+class ResultCache(object):
+    """LRU cache of API results holding at most about `max_size` bytes of
+    responses.
+
+    Results of read-only commands are kept for `ttl` seconds. `ttls` maps
+    API command names or glob patterns to a different time to live; 0
+    disables caching of a command. A command with a positive time to live
+    is treated as read-only. Any other successful command drops the cached
+    results of its package. Iterator sessions are never cached.
+
+    The counters :attr:`hits`, :attr:`misses`, :attr:`evictions` and
+    :attr:`invalidations` are reset by :meth:`clear`.
+    """
+
+    def __init__(self, max_size, ttl=RESULT_CACHE_TTL, ttls=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # key: (expires, size, value, package), least recently used first
+        self._entries = collections.OrderedDict()
+        # package name: set of keys
+        self._packages = {}
+        # package name: number of invalidations, see lookup()
+        self._generations = {}
+        # api command name: time to live or None for mutating commands
+        self._command_ttls = {}
+        self._lock = threading.Lock()
+
+    def from_settings(cls, settings):
+        """Get the cache configured in `settings` or `None` if caching is
+        disabled.
+        """
+        if not settings.get('result_cache_size'):
+            return None
+        return cls(settings['result_cache_size'],
+                   settings.get('result_cache_ttl', RESULT_CACHE_TTL),
+                   settings.get('result_cache_ttls'))
+
+    from_settings = classmethod(from_settings)
+
+    def get_ttl(self, api_command_name):
+        """Get the time to live for results of `api_command_name`: 0 if it
+        is not cached, `None` if it modifies the filer.
+        """
+        try:
+            return self._command_ttls[api_command_name]
+        except KeyError:
+            pass
+        if is_session_command(api_command_name):
+            ttl = 0
+        else:
+            ttl = self.ttls.get(api_command_name)
+            if ttl is None:
+                for pattern, value in self.ttls.items():
+                    if fnmatch.fnmatchcase(api_command_name, pattern):
+                        ttl = value
+                        break
+            if ttl is None and is_read_only(api_command_name):
+                ttl = self.ttl
+        self._command_ttls[api_command_name] = ttl
+        return ttl
+
+    def lookup(self, api_command_name, key):
+        """Look up the result for `key` of `api_command_name`. Returns
+        ``(True, result)`` on a hit, otherwise ``(False, generation)``; pass
+        `generation` to :meth:`store`.
+        """
+        package = api_command_name.split('-')[0]
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.time():
+                    self.hits += 1
+                    # most recently used
+                    del self._entries[key]
+                    self._entries[key] = entry
+                    return True, copy.deepcopy(entry[2])
+                self.__remove(key)
+            self.misses += 1
+            return False, self._generations.get(package, 0)
+        finally:
+            self._lock.release()
+
+    def store(self, api_command_name, key, result, size, generation):
+        """Cache `result` of `api_command_name` for `key`. `size` is the
+        size of the response in bytes. Nothing is stored if the package was
+        invalidated since :meth:`lookup` returned `generation`.
+        """
+        ttl = self.get_ttl(api_command_name)
+        if not ttl or size > self.max_size:
+            return
+        package = api_command_name.split('-')[0]
+        self._lock.acquire()
+        try:
+            if self._generations.get(package, 0) != generation:
+                return
+            if key in self._entries:
+                self.__remove(key)
+            self._entries[key] = (time.time() + ttl, size,
+                                  copy.deepcopy(result), package)
+            self._packages.setdefault(package, set()).add(key)
+            self.size += size
+            while self.size > self.max_size:
+                self.__remove(next(iter(self._entries)))
+                self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def invalidate(self, api_command_name):
+        """Drop the cached results of the package of `api_command_name`."""
+        package = api_command_name.split('-')[0]
+        self._lock.acquire()
+        try:
+            self._generations[package] = \
+                self._generations.get(package, 0) + 1
+            for key in list(self._packages.get(package, ())):
+                self.__remove(key)
+            self.invalidations += 1
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Drop all results and reset the counters."""
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._packages.clear()
+            self.size = 0
+            self.hits = self.misses = 0
+            self.evictions = self.invalidations = 0
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        """Get the counters, the number of entries and their size as a
+        dict.
+        """
+        self._lock.acquire()
+        try:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'size': self.size,
+            }
+        finally:
+            self._lock.release()
+
+    def __remove(self, key):
+        """Remove the entry for `key`; the lock must be held."""
+        entry = self._entries.pop(key)
+        self.size -= entry[1]
+        keys = self._packages.get(entry[3])
+        if keys is not None:
+            keys.discard(key)
+
+
+class RequestCoalescer(object):
+    """Lets concurrent identical requests share one call.
+
+    While a call for a key is in flight, :meth:`call` with the same key
+    waits for it and returns a copy of its result or raises its exception.
+    A caller with a deadline stops waiting with a
+    :class:`schtob.pyontapi.errors.DeadlineExceededError`.
+    :attr:`coalesced` counts the calls which did not send a request.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        # key: _Flight
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def call(self, key, func, expires=None):
+        """Return the result of `func`, shared with concurrent calls for
+        `key`. Waiting for another call ends at the point in time `expires`.
+        """
+        self._lock.acquire()
+        try:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+                leader = False
+        finally:
+            self._lock.release()
+
+        if not leader:
+            if expires is None:
+                flight.done.wait()
+            else:
+                flight.done.wait(max(expires - time.time(), 0))
+                if not flight.done.is_set():
+                    raise errors.DeadlineExceededError(
+                        -1, 'Deadline exceeded waiting for the same call')
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            try:
+                flight.result = func()
+            except:
+                flight.error = sys.exc_info()[1]
+                raise
+        finally:
+            self._lock.acquire()
+            try:
+                del self._flights[key]
+            finally:
+                self._lock.release()
+            flight.done.set()
+        if flight.waiters:
+            # the waiters copy the result concurrently, it must not change
+            return copy.deepcopy(flight.result)
+        return flight.result
+
+
+class _Flight(object):
+    """A call in flight, see :class:`RequestCoalescer`."""
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
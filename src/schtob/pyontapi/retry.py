@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+    schtob.pyontapi.retry
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Retrying transient failures of read-only API commands and failing fast
+    while a filer is down, see the `retry_*` and `circuit_*` settings of
+    :class:`schtob.pyontapi.NaFiler`.
+
+    :copyright: 2010-2015 Schaefer & Tobies SuC GmbH.
+    :author: Markus Grimm <mgr@schaefer-tobies.de>;
+             Uwe W. Schaefer <uws@schaefer-tobies.de>
+    :license: LGPL, see LICENSE for details.
+"""
+
+import random
+import threading
+import time
+
+from schtob.pyontapi import errors, result_cache
+
+# Default delay in seconds before the first retry; doubled per retry.
+RETRY_DELAY = 0.5
+
+# Default upper limit in seconds of the delay between retries.
+RETRY_MAX_DELAY = 10.0
+
+# Default number of seconds an open circuit rejects calls.
+CIRCUIT_TIMEOUT = 30.0
+
+# HTTP result states which mean the filer is overloaded or unavailable.
+RETRY_STATUSES = frozenset([421, 503])
+
+# Names of ONTAPI error numbers (see :data:`na_errno.NA_ERRNO`) which mean
+# "try again later".
+RETRY_ERRNAMES = frozenset([
+    'EONTAPI_EAGAIN',
+    'EONTAPI_EBUSY',
+    'EONTAPI_EINTR',
+    'EONTAPI_ETIMEDOUT',
+    'EONTAPI_ECONNABORTED',
+    'EONTAPI_ECONNRESET',
+    'EONTAPI_ECONNREFUSED',
+    'EHOST_TRYAGAIN',
+    'E_AGAIN',
+])
+
+# States of a :class:`CircuitBreaker`.
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+def is_transient(exc):
+    """Check if the :class:`schtob.pyontapi.errors.APIFailure` `exc` may
+    not happen again if the call is repeated.
+    """
+    if isinstance(exc, errors.ConnectionFailure):
+        return True
+    if isinstance(exc, errors.HTTPStatusError):
+        return exc.status in RETRY_STATUSES
+    return exc.errname in RETRY_ERRNAMES
+
+
+def is_outage(exc):
+    """Check if the :class:`schtob.pyontapi.errors.APIFailure` `exc` means
+    that the filer is down. A deadline which passed while connecting to the
+    filer or waiting for its answer counts as an outage. Returns `None` if
+    it cannot be told, e.g. for deadlines which passed before.
+    """
+    if isinstance(exc, errors.DeadlineExceededError):
+        return exc.unanswered or None
+    if isinstance(exc, errors.CircuitOpenError):
+        return None
+    if isinstance(exc, errors.ConnectionFailure):
+        return True
+    if isinstance(exc, errors.HTTPStatusError):
+        return exc.status >= 500 or exc.status in RETRY_STATUSES
+    return False
+
+
+class RetryPolicy(object):
+    """Retries read-only API commands (see
+    :func:`schtob.pyontapi.result_cache.is_coalescable`) failing with
+    transient errors up to `retries` times.
+
+    Before retry `n` (counting from 0) it waits a random time between 0 and
+    ``delay * 2 ** n`` seconds, but no more than `max_delay`. :attr:`retried`
+    counts the retries.
+    """
+
+    def __init__(self, retries, delay=RETRY_DELAY, max_delay=RETRY_MAX_DELAY):
+        self.retries = retries
+        self.delay = delay
+        self.max_delay = max_delay
+        self.retried = 0
+
+    def from_settings(cls, settings):
+        """Get the policy configured in `settings` or `None` if retries are
+        disabled.
+        """
+        if not settings.get('retries'):
+            return None
+        return cls(settings['retries'],
+                   settings.get('retry_delay', RETRY_DELAY),
+                   settings.get('retry_max_delay', RETRY_MAX_DELAY))
+
+    from_settings = classmethod(from_settings)
+
+    def get_delay(self, api_command_name, exc, attempt, expires=None):
+        """Get the seconds to wait before repeating `api_command_name`
+        which failed with `exc` in retry `attempt`, or `None` if it must
+        not be repeated. Calls are not repeated past the point in time
+        `expires`.
+        """
+        if attempt >= self.retries or \
+                not result_cache.is_coalescable(api_command_name) or \
+                not is_transient(exc):
+            return None
+        delay = random.uniform(0, min(self.max_delay,
+                                      self.delay * 2 ** attempt))
+        if expires is not None and time.time() + delay >= expires:
+            return None
+        self.retried += 1
+        return delay
+
+
+class CircuitBreaker(object):
+    """Fails fast while a filer is down.
+
+    After `threshold` calls in a row failed because the filer seems down
+    (see :func:`is_outage`), the circuit opens: calls raise
+    :class:`schtob.pyontapi.errors.CircuitOpenError` for `timeout`
+    seconds. Then the circuit is half-open and a single call probes the
+    filer; if it gets an answer the circuit closes, otherwise it opens
+    again. :attr:`rejected` counts the calls which were not sent.
+    """
+
+    def __init__(self, threshold, timeout=CIRCUIT_TIMEOUT):
+        self.threshold = threshold
+        self.timeout = timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self._opened = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self, host):
+        """Raise :class:`schtob.pyontapi.errors.CircuitOpenError` unless a
+        call to `host` may be sent now. Each allowed call must be followed
+        by :meth:`record`.
+        """
+        self._lock.acquire()
+        try:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and \
+                    time.time() >= self._opened + self.timeout:
+                self.state = HALF_OPEN
+                return
+            self.rejected += 1
+        finally:
+            self._lock.release()
+        raise errors.CircuitOpenError(
+            'Filer <%s> seems to be down, call not sent' % host)
+
+    def record(self, outage):
+        """Record the outcome of an allowed call: `outage` is `True` if the
+        filer seems down, `False` if it answered and `None` if it cannot be
+        told.
+        """
+        self._lock.acquire()
+        try:
+            if outage is None:
+                if self.state == HALF_OPEN:
+                    # let the next call probe
+                    self.state = OPEN
+                    self._opened = 0.0
+            elif outage:
+                self.failures += 1
+                if self.state == HALF_OPEN or \
+                        self.failures >= self.threshold:
+                    self.state = OPEN
+                    self._opened = time.time()
+            else:
+                self.failures = 0
+                self.state = CLOSED
+        finally:
+            self._lock.release()
+
+
+# Circuit breakers by host and settings, see get_circuit_breaker().
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(host, threshold, timeout=CIRCUIT_TIMEOUT):
+    """Get the :class:`CircuitBreaker` for `host` shared by all filer
+    instances with the same settings.
+    """
+    key = (host, threshold, timeout)
+    _circuit_breakers_lock.acquire()
+    try:
+        breaker = _circuit_breakers.get(key)
+        if breaker is None:
+            breaker = _circuit_breakers[key] = CircuitBreaker(threshold,
+                                                              timeout)
+        return breaker
+    finally:
+        _circuit_breakers_lock.release()
+
+
+def circuit_breaker_from_settings(host, settings):
+    """Get the circuit breaker for `host` configured in `settings` or
+    `None` if it is disabled.
+    """
+    if not settings.get('circuit_threshold'):
+        return None
+    return get_circuit_breaker(host, settings['circuit_threshold'],
+                               settings.get('circuit_timeout',
+                                            CIRCUIT_TIMEOUT))
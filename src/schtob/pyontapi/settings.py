@@ -35,6 +35,11 @@ NA_CONFIG = {
                          'file-read-symlink',
                          ]
         },
+        'volume-reader': {
+            # package names and glob patterns are resolved against
+            # system-api-list
+            'cmd_list': ['volume-get-*', 'volume-list-info*', 'aggr'],
+        },
     },
 
     'filer-roles': {
@@ -60,6 +65,23 @@ NA_CONFIG = {
     # 'transport_type' : constants.HTTP,
     # 'port': None,
     # 'url': None,
+    # 'pool_size': 4,
+    # 'pool_idle_timeout': 30.0,
+    # 'connect_timeout': 10.0,
+    # 'read_timeout': 300.0,
+    # 'transport_cache_ttl': 3600.0,
+    # 'schema_cache_dir': '/var/cache/pyontapi',
+    # 'elements_chunk_size': 200,
+    # 'elements_workers': 4,
+    # 'page_size': 100,
+    # 'prefetch_pages': 2,
+    # 'bindings': 'mybindings',
+    # 'raw_api': True,
+    # 'result_cache_size': 16 * 1024 * 1024,
+    # 'result_cache_ttls': {'options-get': 300, 'perf-*': 0},
+    # 'coalesce_requests': True,
+    # 'retries': 3,
+    # 'circuit_threshold': 5,
 }
 
 
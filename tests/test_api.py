@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.test_api
+    ~~~~~~~~~~~~~~
+
+    Tests for the compiled response decoders of :mod:`schtob.pyontapi.api`.
+
+    :copyright: 2010-2015 Schaefer & Tobies SuC GmbH.
+    :license: LGPL, see LICENSE for details.
+"""
+
+import os
+import sys
+import unittest
+import xml.dom.minidom
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from schtob.pyontapi import api
+
+# a struct and an array of structs with a nested struct each
+RESPONSES = [
+    '<netapp version="1.21"><results status="passed">'
+    '<attributes><vol-attrs><name>v7</name><size>7</size>'
+    '<owner><owner-info><path>/p7</path></owner-info></owner>'
+    '</vol-attrs></attributes>'
+    '</results></netapp>',
+    '<netapp version="1.21"><results status="passed">'
+    '<records>'
+    '<vol-attrs><name>v0</name><size>0</size>'
+    '<owner><owner-info><path>/p0</path></owner-info></owner></vol-attrs>'
+    '<vol-attrs><name>v1</name><size>1</size></vol-attrs>'
+    '</records>'
+    '</results></netapp>',
+]
+
+
+def get_fields(index):
+    """Get the output field with nested named types of response `index`."""
+    owner_info = api.NaNamedType('owner-info', [
+        api.NaTypeElement({'name': 'path', 'type': str})])
+    vol_attrs = api.NaNamedType('vol-attrs', [
+        api.NaTypeElement({'name': 'name', 'type': str}),
+        api.NaTypeElement({'name': 'size', 'type': int}),
+        api.NaTypeElement({'name': 'owner', 'type': owner_info,
+                           'is-optional': True})])
+    return [[api.NaField({'name': 'attributes', 'type': vol_attrs})],
+            [api.NaField({'name': 'records', 'type': vol_attrs,
+                          'is-array': True})]][index]
+
+
+class ResponseDecoderTest(unittest.TestCase):
+
+    def get_results(self, index):
+        """Get the `results` DOM element of response `index`."""
+        doc = xml.dom.minidom.parseString(RESPONSES[index])
+        return doc.getElementsByTagName('results')[0]
+
+    def get_expected(self, index):
+        """Decode response `index` with the DOM based `get_value`."""
+        results = self.get_results(index)
+        value = {}
+        for field in get_fields(index):
+            value[field.name] = field.get_value(results)
+        return value
+
+    def test_get_value(self):
+        self.assertEqual(self.get_expected(0), {
+            'attributes': {'name': 'v7', 'size': 7,
+                           'owner': {'path': '/p7'}}})
+        self.assertEqual(self.get_expected(1), {'records': [
+            {'name': 'v0', 'size': 0, 'owner': {'path': '/p0'}},
+            {'name': 'v1', 'size': 1, 'owner': None}]})
+
+    def test_nested_struct(self):
+        for index in range(len(RESPONSES)):
+            decoder = api.ResponseDecoder(get_fields(index))
+            self.assertEqual(decoder.decode(self.get_results(index)),
+                             self.get_expected(index))
+
+    def test_nested_struct_parser(self):
+        for index in range(len(RESPONSES)):
+            parser = api.ResponseParser(
+                api.ResponseDecoder(get_fields(index)))
+            parser.feed(RESPONSES[index].encode('latin1'))
+            self.assertEqual(parser.close(), self.get_expected(index))
+
+    def test_unwrapped_struct(self):
+        # members given directly in the field element
+        response = RESPONSES[0].replace('<vol-attrs>', '').replace(
+            '</vol-attrs>', '')
+        parser = api.ResponseParser(api.ResponseDecoder(get_fields(0)))
+        parser.feed(response.encode('latin1'))
+        self.assertEqual(parser.close(), self.get_expected(0))
+
+
+if __name__ == '__main__':
+    unittest.main()